@@ -1,57 +1,133 @@
+import concurrent.futures
 import os
+import subprocess
+import threading
+import time
+from collections import OrderedDict
 import yt_dlp
-from moviepy.audio.io.AudioFileClip import AudioFileClip
 import imageio_ffmpeg
 
+from disk_cache import DiskCache
+
+# Search results change slowly; a URL's metadata hardly at all
+SEARCH_CACHE_TTL = 6 * 60 * 60
+URL_CACHE_TTL = 24 * 60 * 60
+SEARCH_MEMORY_ENTRIES = 512
+SEARCH_CACHE_DIR = os.environ.get("SEARCH_CACHE_DIR", os.path.join("cache", "ytsearch"))
+SEARCH_CACHE_MAX_BYTES = 20 * 1024 * 1024
+
+_search_local = threading.local()
+_search_lock = threading.Lock()
+# key -> (stored_at, results), least recently used first
+_search_memory = OrderedDict()
+# key -> Future resolved by the thread running that search
+_search_in_flight = {}
+_search_disk = DiskCache(SEARCH_CACHE_DIR, SEARCH_CACHE_MAX_BYTES)
+
+
+def _search_ydl():
+    """
+    This thread's YoutubeDL for searches. Building one loads every
+    extractor, so each thread keeps its own (they are not thread-safe).
+    """
+    ydl = getattr(_search_local, "ydl", None)
+    if ydl is None:
+        ydl_opts = {
+            'format': 'bestaudio/best',
+            'noplaylist': True,
+            'quiet': True,
+            'extract_flat': True,  # Don't download, just extract info
+        }
+        ydl = yt_dlp.YoutubeDL(ydl_opts)
+        _search_local.ydl = ydl
+    return ydl
+
+
+def _run_search(query, limit):
+    """Searches YouTube (or reads one URL's metadata); raises on errors."""
+    print(f"Searching YouTube for: '{query}'...")
+    ydl = _search_ydl()
+
+    # Check if query is a URL
+    if query.startswith("http://") or query.startswith("https://"):
+        info = ydl.extract_info(query, download=False)
+        # info might be a single video or a playlist (but we set noplaylist)
+        if 'entries' in info:
+            # It's a playlist or search result, though noplaylist is set
+            entries = info['entries']
+        else:
+            # Single video
+            entries = [info]
+    else:
+        info = ydl.extract_info(
+            f"ytsearch{limit}:{query}", download=False)
+        entries = info.get('entries', [])
+
+    results = []
+    for entry in entries:
+        if not entry:
+            continue
+        video_id = entry.get('id')
+        results.append({
+            'id': video_id,
+            'title': entry.get('title'),
+            'uploader': entry.get('uploader'),
+            'duration': entry.get('duration'),
+            'url': entry.get('url') or f"https://www.youtube.com/watch?v={video_id}",
+            'thumbnail': f"https://img.youtube.com/vi/{video_id}/hqdefault.jpg"
+        })
+    return results
+
 
 def search_videos(query, limit=5):
     """
     Searches for videos on YouTube and returns metadata.
     If query is a URL, returns metadata for that specific video.
+
+    Results are cached in memory and on disk, and concurrent calls for the
+    same search in this process share one request.
     """
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'noplaylist': True,
-        'quiet': True,
-        'extract_flat': True,  # Don't download, just extract info
-    }
+    is_url = query.startswith("http://") or query.startswith("https://")
+    key = f"url:{query}" if is_url else f"search:{limit}:{query}"
+    ttl = URL_CACHE_TTL if is_url else SEARCH_CACHE_TTL
+
+    with _search_lock:
+        cached = _search_memory.get(key)
+        if cached is not None and time.time() - cached[0] <= ttl:
+            _search_memory.move_to_end(key)
+            return list(cached[1])
+
+        in_flight = _search_in_flight.get(key)
+        owner = in_flight is None
+        if owner:
+            in_flight = _search_in_flight[key] = concurrent.futures.Future()
+
+    if not owner:
+        return list(in_flight.result())
 
     results = []
-    print(f"Searching YouTube for: '{query}'...")
+    try:
+        stored = _search_disk.get(key, ttl)
+        if stored is not None:
+            results = stored
+        else:
+            results = _run_search(query, limit)
+            _search_disk.put(key, results)
+            _search_disk.trim()
 
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        try:
-            # Check if query is a URL
-            if query.startswith("http://") or query.startswith("https://"):
-                info = ydl.extract_info(query, download=False)
-                # info might be a single video or a playlist (but we set noplaylist)
-                if 'entries' in info:
-                    # It's a playlist or search result, though noplaylist is set
-                    entries = info['entries']
-                else:
-                    # Single video
-                    entries = [info]
-            else:
-                info = ydl.extract_info(
-                    f"ytsearch{limit}:{query}", download=False)
-                entries = info.get('entries', [])
-
-            for entry in entries:
-                if not entry:
-                    continue
-                video_id = entry.get('id')
-                results.append({
-                    'id': video_id,
-                    'title': entry.get('title'),
-                    'uploader': entry.get('uploader'),
-                    'duration': entry.get('duration'),
-                    'url': entry.get('url') or f"https://www.youtube.com/watch?v={video_id}",
-                    'thumbnail': f"https://img.youtube.com/vi/{video_id}/hqdefault.jpg"
-                })
-        except Exception as e:
-            print(f"Error searching videos: {e}")
+        with _search_lock:
+            _search_memory[key] = (time.time(), results)
+            while len(_search_memory) > SEARCH_MEMORY_ENTRIES:
+                _search_memory.popitem(last=False)
+    except Exception as e:
+        # Failures are not cached, so the next call tries again
+        print(f"Error searching videos: {e}")
+    finally:
+        with _search_lock:
+            del _search_in_flight[key]
+        in_flight.set_result(results)
 
-    return results
+    return list(results)
 
 
 def download_audio_by_url(url, temp_filename="full_audio"):
@@ -97,30 +173,86 @@ def first_audio(query):
 def trim_audio(input_path, output_path, start_time, end_time):
     """
     Trims the audio file to the specified start and end times.
+
+    ffmpeg seeks in the input, so only the kept range is decoded, and it
+    is encoded once in the format given by output_path's extension. A
+    .m4a output is AAC, which the video mux then copies as is.
     """
+    start = max(0, start_time)
+    if start >= end_time:
+        print("Error: Start time is after end time.")
+        return False
+
+    print(f"Trimming audio from {start}s to {end_time}s...")
+    cmd = [imageio_ffmpeg.get_ffmpeg_exe(), '-y', '-loglevel', 'warning',
+           '-ss', f"{start:.3f}", '-t', f"{end_time - start:.3f}",
+           '-i', input_path, '-vn']
+    if output_path.lower().endswith(('.m4a', '.aac')):
+        cmd += ['-c:a', 'aac']
+    cmd.append(output_path)
+
     try:
-        print(f"Trimming audio from {start_time}s to {end_time}s...")
-        audio = AudioFileClip(input_path)
+        result = subprocess.run(cmd, check=True, capture_output=True)
+    except subprocess.CalledProcessError as e:
+        print(f"Error trimming audio: {e.stderr.decode(errors='replace').strip()}")
+        return False
+    except Exception as e:
+        print(f"Error trimming audio: {e}")
+        return False
 
-        # Ensure times are within bounds
-        start = max(0, start_time)
-        end = min(audio.duration, end_time)
+    # Seeking past the end of the input succeeds with an empty file
+    if b"Output file is empty" in result.stderr or not os.path.exists(output_path):
+        print("Error: Trimmed audio is empty.")
+        return False
+    return True
 
-        if start >= end:
-            print("Error: Start time is after end time.")
-            return False
+def trim_audio_ranges(input_path, ranges):
+    """
+    Cuts several (start_time, end_time, output_path) ranges out of one
+    audio file. The input is decoded once, from the earliest start to the
+    latest end, and split between the outputs, each encoded as in
+    trim_audio. Returns whether each output was written, in order.
+    """
+    results = [False] * len(ranges)
+    valid = [i for i, (start, end, _) in enumerate(ranges) if max(0, start) < end]
+    if len(valid) < len(ranges):
+        print("Error: Start time is after end time.")
+    if not valid:
+        return results
 
-        trimmed = audio.subclip(start, end)
-        trimmed.write_audiofile(output_path, logger=None)
+    first = min(max(0, ranges[i][0]) for i in valid)
+    last = max(ranges[i][1] for i in valid)
+    print(f"Trimming {len(valid)} audio ranges from {first}s to {last}s...")
 
-        # Close to release file lock
-        audio.close()
-        trimmed.close()
+    filters = [f"[0:a]asplit={len(valid)}" + "".join(f"[s{i}]" for i in valid)]
+    outputs = []
+    for i in valid:
+        start, end, output_path = ranges[i]
+        filters.append(f"[s{i}]atrim=start={max(0, start) - first:.3f}:end={end - first:.3f},"
+                       f"asetpts=PTS-STARTPTS[o{i}]")
+        outputs += ['-map', f"[o{i}]"]
+        if output_path.lower().endswith(('.m4a', '.aac')):
+            outputs += ['-c:a', 'aac']
+        outputs.append(output_path)
 
-        return True
+    cmd = [imageio_ffmpeg.get_ffmpeg_exe(), '-y', '-loglevel', 'warning',
+           '-ss', f"{first:.3f}", '-t', f"{last - first:.3f}",
+           '-i', input_path, '-filter_complex', ";".join(filters)] + outputs
+
+    # ffmpeg fails as a whole when any output gets no audio (a range past
+    # the end of the input), but still writes the others
+    try:
+        result = subprocess.run(cmd, capture_output=True)
     except Exception as e:
         print(f"Error trimming audio: {e}")
-        return False
+        return results
+    if result.returncode != 0:
+        print(f"Error trimming audio: {result.stderr.decode(errors='replace').strip()}")
+
+    for i in valid:
+        output_path = ranges[i][2]
+        results[i] = os.path.exists(output_path) and os.path.getsize(output_path) > 0
+    return results
 
 # Cleanup helper
 
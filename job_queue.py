@@ -0,0 +1,461 @@
+import sqlite3
+import threading
+import time
+
+# A claimed job whose lease is not renewed within this many seconds is
+# assumed lost (worker crashed or was killed) and handed out again
+LEASE_SECONDS = 60
+# Claims per job before it is given up on
+MAX_ATTEMPTS = 3
+
+# Finished jobs are deleted once older than this many seconds, and beyond
+# the newest JOB_HISTORY_LIMIT of them
+JOB_TTL_SECONDS = 24 * 60 * 60
+JOB_HISTORY_LIMIT = 1000
+
+ACTIVE_STATUSES = ("queued", "processing")
+
+# A job passes through these stages in order, each run by its own pool of
+# workers. A job waiting for its next stage is 'processing' with no lease.
+STAGES = ("fetch", "render")
+# Stage of a job that found another live job producing the same video
+# (same render fingerprint) and waits for that job's result instead
+FOLLOW_STAGE = "follow"
+# Stage of a batch (a job with clip jobs under it, see enqueue_batch)
+# once its clips are fetched, and of each clip until then
+BATCH_STAGE = "batch"
+
+
+def connect(db_path):
+    """
+    Opens a connection to the job store. Rows come back as sqlite3.Row;
+    writers wait for each other instead of failing with 'database is locked'.
+    """
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def init_jobs(db_path):
+    """
+    Creates the jobs table and switches the database to WAL mode, so
+    readers (status polls) never block the workers writing to it.
+    """
+    conn = connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute('''CREATE TABLE IF NOT EXISTS jobs
+                 (id TEXT PRIMARY KEY,
+                  status TEXT NOT NULL,
+                  payload TEXT NOT NULL,
+                  result TEXT,
+                  error TEXT,
+                  created_at REAL NOT NULL,
+                  base_name TEXT,
+                  lease_owner TEXT,
+                  lease_expires REAL,
+                  attempts INTEGER NOT NULL DEFAULT 0,
+                  finished_at REAL,
+                  stage TEXT NOT NULL DEFAULT 'fetch',
+                  fingerprint TEXT,
+                  parent_id TEXT)''')
+    columns = [row['name'] for row in conn.execute("PRAGMA table_info(jobs)")]
+    if 'finished_at' not in columns:
+        conn.execute("ALTER TABLE jobs ADD COLUMN finished_at REAL")
+    if 'stage' not in columns:
+        conn.execute(
+            "ALTER TABLE jobs ADD COLUMN stage TEXT NOT NULL DEFAULT 'fetch'")
+    if 'fingerprint' not in columns:
+        conn.execute("ALTER TABLE jobs ADD COLUMN fingerprint TEXT")
+    if 'parent_id' not in columns:
+        conn.execute("ALTER TABLE jobs ADD COLUMN parent_id TEXT")
+    conn.execute('''CREATE INDEX IF NOT EXISTS jobs_status_created
+                 ON jobs (status, created_at)''')
+    conn.execute('''CREATE INDEX IF NOT EXISTS jobs_finished
+                 ON jobs (finished_at) WHERE finished_at IS NOT NULL''')
+    conn.execute('''CREATE INDEX IF NOT EXISTS jobs_fingerprint
+                 ON jobs (fingerprint) WHERE fingerprint IS NOT NULL''')
+    conn.execute('''CREATE INDEX IF NOT EXISTS jobs_parent
+                 ON jobs (parent_id) WHERE parent_id IS NOT NULL''')
+
+    # Bumped whenever the set or order of queued jobs changes
+    conn.execute('''CREATE TABLE IF NOT EXISTS queue_version
+                 (id INTEGER PRIMARY KEY CHECK (id = 0),
+                  version INTEGER NOT NULL)''')
+    conn.execute(
+        "INSERT OR IGNORE INTO queue_version (id, version) VALUES (0, 0)")
+    conn.close()
+
+
+def _bump_queue_version(conn):
+    conn.execute("UPDATE queue_version SET version = version + 1 WHERE id = 0")
+
+
+def enqueue_job(db_path, job_id, payload, created_at=None):
+    """Adds a queued job. payload is the JSON-encoded request."""
+    conn = connect(db_path)
+    try:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT INTO jobs (id, status, payload, created_at) VALUES (?, 'queued', ?, ?)",
+                         (job_id, payload, created_at or time.time()))
+            _bump_queue_version(conn)
+    finally:
+        conn.close()
+
+
+def enqueue_batch(db_path, job_id, payload, clips, created_at=None):
+    """
+    Adds a queued batch: a job fetched once for all of its clips, which
+    then render as jobs of their own. clips is a list of
+    (clip_job_id, payload). The clip jobs wait in BATCH_STAGE until
+    release_batch hands them on.
+    """
+    created_at = created_at or time.time()
+    conn = connect(db_path)
+    try:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT INTO jobs (id, status, payload, created_at) VALUES (?, 'queued', ?, ?)",
+                         (job_id, payload, created_at))
+            conn.executemany('''INSERT INTO jobs (id, status, payload, created_at, stage, parent_id)
+                                VALUES (?, 'processing', ?, ?, ?, ?)''',
+                             [(clip_id, clip_payload, created_at, BATCH_STAGE, job_id)
+                              for clip_id, clip_payload in clips])
+            _bump_queue_version(conn)
+    finally:
+        conn.close()
+
+
+def get_job(db_path, job_id):
+    """Returns the job row as a dict, or None."""
+    conn = connect(db_path)
+    try:
+        row = conn.execute(
+            "SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    return dict(row) if row else None
+
+
+def get_clips(db_path, job_id):
+    """Returns the clip jobs of a batch as dicts, in the order they were given."""
+    conn = connect(db_path)
+    try:
+        rows = conn.execute("SELECT * FROM jobs WHERE parent_id = ? ORDER BY rowid",
+                            (job_id,)).fetchall()
+    finally:
+        conn.close()
+    return [dict(row) for row in rows]
+
+
+class QueuePositions:
+    """
+    Positions of the queued jobs, rebuilt only when the queue version
+    changes. Between changes a lookup is one primary-key read plus a dict
+    lookup, however many jobs are queued or polling.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._version = None
+        self._positions = {}
+
+    def position(self, job_id):
+        """1-based position of a queued job, or 0 if it is not queued."""
+        conn = connect(self.db_path)
+        try:
+            with self._lock:
+                # One read transaction, so the version matches the rows
+                conn.execute("BEGIN")
+                version = conn.execute(
+                    "SELECT version FROM queue_version WHERE id = 0").fetchone()[0]
+                if version != self._version:
+                    rows = conn.execute(
+                        "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at")
+                    self._positions = {row['id']: i + 1
+                                       for i, row in enumerate(rows)}
+                    self._version = version
+                conn.execute("COMMIT")
+                return self._positions.get(job_id, 0)
+        finally:
+            conn.close()
+
+
+def purge_finished(db_path, ttl_seconds=JOB_TTL_SECONDS, limit=JOB_HISTORY_LIMIT):
+    """
+    Deletes finished jobs older than ttl_seconds, and all but the newest
+    `limit` finished jobs. Returns the number of jobs deleted.
+    """
+    conn = connect(db_path)
+    try:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            deleted = conn.execute("DELETE FROM jobs WHERE finished_at < ?",
+                                   (time.time() - ttl_seconds,)).rowcount
+            cutoff = conn.execute('''SELECT finished_at FROM jobs WHERE finished_at IS NOT NULL
+                                      ORDER BY finished_at DESC LIMIT 1 OFFSET ?''', (limit,)).fetchone()
+            if cutoff is not None:
+                deleted += conn.execute("DELETE FROM jobs WHERE finished_at <= ?",
+                                        (cutoff[0],)).rowcount
+    finally:
+        conn.close()
+    return deleted
+
+
+def claim_job(db_path, owner, stage="fetch", lease_seconds=LEASE_SECONDS):
+    """
+    Atomically takes the oldest job waiting for `stage`, or one in that
+    stage whose lease has expired, and leases it to owner. The first
+    stage takes queued jobs; later ones take jobs advanced to them.
+    Returns the job row as a dict, or None if there is nothing to do.
+    """
+    now = time.time()
+    conn = connect(db_path)
+    try:
+        # IMMEDIATE takes the write lock up front, so two workers can never
+        # select the same row
+        conn.execute("BEGIN IMMEDIATE")
+
+        # Give up on jobs whose workers keep dying
+        conn.execute('''UPDATE jobs SET status = 'failed', error = 'Worker lost too many times',
+                            lease_owner = NULL, lease_expires = NULL, finished_at = ?
+                        WHERE status = 'processing' AND lease_expires < ? AND attempts >= ?''',
+                     (now, now, MAX_ATTEMPTS))
+        _settle_batches(conn, now)
+
+        if stage == STAGES[0]:
+            # Followers of a job that failed or was cancelled start over
+            conn.execute('''UPDATE jobs SET stage = ? WHERE stage = ? AND status = 'processing'
+                              AND NOT EXISTS (SELECT 1 FROM jobs AS leader
+                                              WHERE leader.fingerprint = jobs.fingerprint
+                                                AND leader.status = 'processing' AND leader.stage != ?)''',
+                         (stage, FOLLOW_STAGE, FOLLOW_STAGE))
+
+        # Jobs of lost workers (or waiting for this stage) first; they
+        # are older than anything queued
+        row = conn.execute('''SELECT id FROM jobs WHERE status = 'processing' AND stage = ?
+                                AND (lease_expires < ? OR lease_owner IS NULL)
+                              ORDER BY created_at LIMIT 1''', (stage, now)).fetchone()
+        if row is None and stage == STAGES[0]:
+            row = conn.execute('''SELECT id FROM jobs WHERE status = 'queued'
+                                  ORDER BY created_at LIMIT 1''').fetchone()
+            if row is not None:
+                _bump_queue_version(conn)
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+
+        conn.execute('''UPDATE jobs SET status = 'processing', lease_owner = ?,
+                            lease_expires = ?, attempts = attempts + 1
+                        WHERE id = ?''', (owner, now + lease_seconds, row['id']))
+        job = conn.execute(
+            "SELECT * FROM jobs WHERE id = ?", (row['id'],)).fetchone()
+        conn.execute("COMMIT")
+        return dict(job)
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def renew_lease(db_path, job_id, owner, base_name=None, lease_seconds=LEASE_SECONDS):
+    """
+    Extends owner's lease on a running job and records its file stem.
+    Returns False if the job was cancelled or is no longer owner's.
+    """
+    conn = connect(db_path)
+    try:
+        cur = conn.execute('''UPDATE jobs SET lease_expires = ?, base_name = COALESCE(?, base_name)
+                              WHERE id = ? AND lease_owner = ? AND status = 'processing' ''',
+                           (time.time() + lease_seconds, base_name, job_id, owner))
+    finally:
+        conn.close()
+    return cur.rowcount == 1
+
+
+def advance_job(db_path, job_id, owner, stage, payload=None):
+    """
+    Hands a job owner holds over to the next stage, releasing the lease
+    and optionally replacing its payload.
+    Returns False if the job was cancelled or re-leased in the meantime.
+    """
+    conn = connect(db_path)
+    try:
+        cur = conn.execute('''UPDATE jobs SET stage = ?, payload = COALESCE(?, payload),
+                                  lease_owner = NULL, lease_expires = NULL, attempts = 0
+                              WHERE id = ? AND lease_owner = ? AND status = 'processing' ''',
+                           (stage, payload, job_id, owner))
+    finally:
+        conn.close()
+    return cur.rowcount == 1
+
+
+def _find_leader(conn, job_id, fingerprint):
+    """Another live job producing the video with this fingerprint, or None."""
+    return conn.execute('''SELECT id FROM jobs WHERE fingerprint = ? AND id != ?
+                            AND status = 'processing' AND stage != ?
+                          LIMIT 1''', (fingerprint, job_id, FOLLOW_STAGE)).fetchone()
+
+
+def lead_render(db_path, job_id, owner, fingerprint):
+    """
+    Records the render fingerprint of a job owner holds. If another live
+    job already has the same fingerprint, this one follows it instead: it
+    gives up its lease, and finish_job completes it with the other job's
+    result. Returns True if the job should go on to render itself.
+    """
+    conn = connect(db_path)
+    try:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if _find_leader(conn, job_id, fingerprint) is None:
+                cur = conn.execute('''UPDATE jobs SET fingerprint = ?
+                                      WHERE id = ? AND lease_owner = ? AND status = 'processing' ''',
+                                   (fingerprint, job_id, owner))
+                return cur.rowcount == 1
+
+            conn.execute('''UPDATE jobs SET fingerprint = ?, stage = ?, lease_owner = NULL,
+                                lease_expires = NULL, attempts = 0
+                            WHERE id = ? AND lease_owner = ? AND status = 'processing' ''',
+                         (fingerprint, FOLLOW_STAGE, job_id, owner))
+            return False
+    finally:
+        conn.close()
+
+
+def release_batch(db_path, job_id, owner, outcomes):
+    """
+    Hands the clips of a batch owner holds over once they are fetched.
+    outcomes has one dict per clip with its 'id', 'status' ('render' to
+    go on to the render stage, 'follow' to wait for another clip with the
+    same fingerprint, or 'completed'/'failed' if there is nothing to
+    render), and the 'payload', 'base_name', 'fingerprint',
+    'result' and 'error' to record. A clip to render whose video another
+    live job is already producing follows that job instead, as in
+    lead_render. The batch itself waits in BATCH_STAGE until its last
+    clip finishes.
+    Returns the ids of the clips that follow another job (their fetched
+    files are not needed), or None if the batch was cancelled or
+    re-leased in the meantime.
+    """
+    now = time.time()
+    conn = connect(db_path)
+    try:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            cur = conn.execute('''UPDATE jobs SET stage = ?, lease_owner = NULL, lease_expires = NULL
+                                  WHERE id = ? AND lease_owner = ? AND status = 'processing' ''',
+                               (BATCH_STAGE, job_id, owner))
+            if cur.rowcount != 1:
+                return None
+
+            followers = []
+            for outcome in outcomes:
+                if outcome['status'] in ("render", "follow"):
+                    stage = STAGES[1]
+                    if outcome['status'] == "follow" or _find_leader(conn, outcome['id'], outcome['fingerprint']):
+                        stage = FOLLOW_STAGE
+                        followers.append(outcome['id'])
+                    conn.execute('''UPDATE jobs SET stage = ?, payload = ?, base_name = ?, fingerprint = ?
+                                    WHERE id = ? AND parent_id = ? AND status = 'processing' ''',
+                                 (stage, outcome['payload'], outcome['base_name'],
+                                  outcome['fingerprint'], outcome['id'], job_id))
+                else:
+                    conn.execute('''UPDATE jobs SET status = ?, payload = ?, fingerprint = ?,
+                                        result = ?, error = ?, finished_at = ?
+                                    WHERE id = ? AND parent_id = ? AND status = 'processing' ''',
+                                 (outcome['status'], outcome['payload'], outcome.get('fingerprint'),
+                                  outcome.get('result'), outcome.get('error'), now,
+                                  outcome['id'], job_id))
+            _settle_batches(conn, now)
+            return followers
+    finally:
+        conn.close()
+
+
+def _settle_batches(conn, now):
+    """
+    Ends the clips of batches that failed or were cancelled the same way,
+    and finishes batches none of whose clips are still running: completed
+    if every clip was, failed otherwise.
+    """
+    ended = conn.execute('''SELECT clip.id, batch.status, batch.error
+                            FROM jobs AS clip JOIN jobs AS batch ON batch.id = clip.parent_id
+                            WHERE clip.status IN (?, ?) AND batch.status NOT IN (?, ?)''',
+                         (*ACTIVE_STATUSES, *ACTIVE_STATUSES)).fetchall()
+    conn.executemany('''UPDATE jobs SET status = ?, error = ?, lease_owner = NULL,
+                            lease_expires = NULL, finished_at = ?
+                        WHERE id = ?''',
+                     [(row['status'], row['error'], now, row['id']) for row in ended])
+
+    batches = conn.execute('''SELECT batch.id, COUNT(*) AS clips,
+                                     SUM(clip.status = 'completed') AS completed
+                              FROM jobs AS batch JOIN jobs AS clip ON clip.parent_id = batch.id
+                              WHERE batch.status = 'processing' AND batch.stage = ?
+                              GROUP BY batch.id
+                              HAVING SUM(clip.status IN (?, ?)) = 0''',
+                           (BATCH_STAGE, *ACTIVE_STATUSES)).fetchall()
+    for batch in batches:
+        if batch['completed'] == batch['clips']:
+            status, error = "completed", None
+        else:
+            status = "failed"
+            error = f"{batch['clips'] - batch['completed']} of {batch['clips']} clips did not complete"
+        conn.execute('''UPDATE jobs SET status = ?, error = ?, finished_at = ?
+                        WHERE id = ?''', (status, error, now, batch['id']))
+
+
+def finish_job(db_path, job_id, owner, status, result=None, error=None):
+    """
+    Records the outcome of a job owner still holds the lease on, and
+    completes the jobs following it if it succeeded.
+    Returns False if the job was cancelled or re-leased in the meantime.
+    """
+    now = time.time()
+    conn = connect(db_path)
+    try:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            cur = conn.execute('''UPDATE jobs SET status = ?, result = ?, error = ?,
+                                      lease_owner = NULL, lease_expires = NULL, finished_at = ?
+                                  WHERE id = ? AND lease_owner = ? AND status = 'processing' ''',
+                               (status, result, error, now, job_id, owner))
+            if cur.rowcount == 1 and status == "completed":
+                conn.execute('''UPDATE jobs SET status = 'completed', result = ?, finished_at = ?
+                                WHERE stage = ? AND status = 'processing'
+                                  AND fingerprint = (SELECT fingerprint FROM jobs WHERE id = ?)''',
+                             (result, now, FOLLOW_STAGE, job_id))
+            _settle_batches(conn, now)
+    finally:
+        conn.close()
+    return cur.rowcount == 1
+
+
+def cancel_job(db_path, job_id):
+    """
+    Marks a queued or running job as cancelled.
+    Returns the job's status before the call, or None if it does not exist.
+    """
+    conn = connect(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is not None and row['status'] in ACTIVE_STATUSES:
+            now = time.time()
+            conn.execute("UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ?",
+                         (now, job_id))
+            if row['status'] == 'queued':
+                _bump_queue_version(conn)
+            _settle_batches(conn, now)
+        conn.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return row['status'] if row else None
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+
+class SegmentLayoutCache:
+    """
+    Layouts of lyric segments, shared by every process using `path`.
+
+    Each entry holds, for every prefix of a segment's words, the chosen
+    font size and the word positions (which give the line breaks), keyed
+    by a hash of the words, font, maximum font size and canvas. Entries
+    live in one SQLite file; the least recently used ones are evicted
+    once their total size exceeds `max_bytes`. Hit, miss, store and
+    eviction counters are kept in the same file.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''CREATE TABLE IF NOT EXISTS layouts
+                         (key TEXT PRIMARY KEY,
+                          value TEXT NOT NULL,
+                          size INTEGER NOT NULL,
+                          last_access REAL NOT NULL)''')
+            conn.execute('''CREATE INDEX IF NOT EXISTS layouts_last_access
+                         ON layouts (last_access)''')
+            conn.execute('''CREATE TABLE IF NOT EXISTS layout_stats
+                         (name TEXT PRIMARY KEY, value INTEGER NOT NULL)''')
+            conn.executemany("INSERT OR IGNORE INTO layout_stats (name, value) VALUES (?, 0)",
+                             [(name,) for name in ("hits", "misses", "stores", "evictions")])
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _count(conn, name, amount=1):
+        conn.execute(
+            "UPDATE layout_stats SET value = value + ? WHERE name = ?", (amount, name))
+
+    @staticmethod
+    def make_key(words, font_id, max_font_size, size, max_text_height, version):
+        """Cache key of one segment's layout."""
+        key = {
+            'version': version,
+            'words': list(words),
+            'font': font_id,
+            'max_font_size': max_font_size,
+            'size': list(size),
+            'max_text_height': max_text_height,
+        }
+        encoded = json.dumps(key, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Returns the layout stored under key, or None on a miss."""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute(
+                    "SELECT value FROM layouts WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    self._count(conn, "misses")
+                    return None
+                conn.execute("UPDATE layouts SET last_access = ? WHERE key = ?",
+                             (time.time(), key))
+                self._count(conn, "hits")
+        finally:
+            conn.close()
+        return json.loads(row['value'])
+
+    def put(self, key, layout):
+        """Stores a layout, evicting least recently used ones to stay within max_bytes."""
+        value = json.dumps(layout, separators=(',', ':'))
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute('''INSERT OR REPLACE INTO layouts (key, value, size, last_access)
+                                VALUES (?, ?, ?, ?)''',
+                             (key, value, len(value), time.time()))
+                self._count(conn, "stores")
+                self._evict(conn, keep=key)
+        finally:
+            conn.close()
+
+    def _evict(self, conn, keep=None):
+        total = conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM layouts").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        rows = conn.execute(
+            "SELECT key, size FROM layouts ORDER BY last_access").fetchall()
+        evicted = 0
+        for row in rows:
+            if total <= self.max_bytes:
+                break
+            if row['key'] == keep:
+                continue
+            conn.execute("DELETE FROM layouts WHERE key = ?", (row['key'],))
+            total -= row['size']
+            evicted += 1
+        if evicted:
+            self._count(conn, "evictions", evicted)
+
+    def stats(self):
+        """Returns hit/miss/store/eviction counters and the cache's size."""
+        conn = self._connect()
+        try:
+            stats = {row['name']: row['value']
+                     for row in conn.execute("SELECT name, value FROM layout_stats")}
+            entries, size = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM layouts").fetchone()
+        finally:
+            conn.close()
+        stats["entries"] = entries
+        stats["bytes"] = size
+        stats["max_bytes"] = self.max_bytes
+        return stats
@@ -1,5 +1,89 @@
-import requests
+import os
 import re
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from disk_cache import DiskCache
+
+# Point at a local stub to test without the network
+LRCLIB_URL = os.environ.get("LRCLIB_URL", "https://lrclib.net").rstrip("/")
+# (connect, read) seconds
+REQUEST_TIMEOUT = (5, 15)
+
+# Responses are cached on disk as one JSON file per query or track id.
+# Search results can change as tracks are added; a track's lyrics do not.
+LYRICS_CACHE_DIR = os.environ.get("LYRICS_CACHE_DIR", os.path.join("cache", "lrclib"))
+LYRICS_CACHE_MAX_BYTES = 50 * 1024 * 1024
+SEARCH_TTL_SECONDS = 24 * 60 * 60
+TRACK_TTL_SECONDS = 30 * 24 * 60 * 60
+
+_session = None
+_session_lock = threading.Lock()
+_cache = DiskCache(LYRICS_CACHE_DIR, LYRICS_CACHE_MAX_BYTES)
+
+
+def get_session():
+    """
+    Returns the process-wide requests session: pooled keep-alive
+    connections, with retries on connection errors and 429/5xx.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(total=3, backoff_factor=0.5,
+                          status_forcelist=(429, 500, 502, 503, 504),
+                          allowed_methods=("GET",))
+            adapter = HTTPAdapter(max_retries=retry,
+                                  pool_connections=4, pool_maxsize=16)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers["User-Agent"] = "brat-lyrics-generator"
+            _session = session
+        return _session
+
+
+def _fetch_json(path, params=None):
+    response = get_session().get(f"{LRCLIB_URL}{path}", params=params,
+                                 timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+
+def lrclib_search(query):
+    """
+    Raw LRCLIB search results for query, from the cache when fresh.
+    Each result is also cached as its track, so picking one later never
+    needs another request.
+    """
+    key = f"search:{query}"
+    results = _cache.get(key, SEARCH_TTL_SECONDS)
+    if results is not None:
+        return results
+
+    results = _fetch_json("/api/search", params={"q": query})
+    _cache.put(key, results)
+    for track in results:
+        if track.get('id') is not None:
+            _cache.put(f"track:{track['id']}", track)
+    _cache.trim()
+    return results
+
+
+def lrclib_track(track_id):
+    """Raw LRCLIB record for a track id, from the cache when fresh."""
+    key = f"track:{track_id}"
+    track = _cache.get(key, TRACK_TTL_SECONDS)
+    if track is not None:
+        return track
+
+    track = _fetch_json(f"/api/get/{track_id}")
+    _cache.put(key, track)
+    _cache.trim()
+    return track
 
 
 def get_lyrics(artist, song_name):
@@ -7,16 +91,8 @@ def get_lyrics(artist, song_name):
     Fetches synchronized lyrics from LRCLIB.net
     Returns list of dicts: [{'start': 0.0, 'text': 'Lyric line...'}, ...]
     """
-    url = "https://lrclib.net/api/search"
-    params = {
-        "q": f"{song_name} {artist}"
-    }
-
     try:
-        response = requests.get(url, params=params)
-        print(response.url)
-        response.raise_for_status()
-        results = response.json()
+        results = lrclib_search(f"{song_name} {artist}")
 
         # Filter for synced lyrics
         synced_results = [r for r in results if r.get('syncedLyrics')]
@@ -43,13 +119,8 @@ def search_lyrics(query):
     Searches for synchronized lyrics from LRCLIB.net
     Returns list of track dicts with id, name, artist, album, duration, syncedLyrics
     """
-    url = "https://lrclib.net/api/search"
-    params = {"q": query}
-
     try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        results = response.json()
+        results = lrclib_search(query)
 
         # Filter for matched synced lyrics
         clean_results = []
@@ -75,11 +146,8 @@ def get_lyrics_by_id(conn_id):
     """
     Fetches lyrics by LRCLIB ID
     """
-    url = f"https://lrclib.net/api/get/{conn_id}"
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
+        data = lrclib_track(conn_id)
         if data.get('syncedLyrics'):
             return parse_lrc(data['syncedLyrics'])
         return None
@@ -1,11 +1,158 @@
 import argparse
+import functools
+import hashlib
+import io
+import itertools
 import json
 import math
+import multiprocessing
 import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image, ImageDraw, ImageFont
-from moviepy.editor import AudioFileClip, ImageClip, CompositeVideoClip, ColorClip
+from moviepy.editor import AudioFileClip, VideoClip
+import imageio_ffmpeg
 import numpy as np
 
+from disk_cache import DiskCache
+from layout_cache import SegmentLayoutCache
+
+
+FONT_PATH = "arial.ttf"
+
+VIDEO_SIZE = (1080, 1920)
+# Define effective text area
+# 20% top padding, 20% bottom padding -> 60% height usable
+MAX_TEXT_HEIGHT = VIDEO_SIZE[1] * 0.6
+
+# Most frames render_preview draws in one contact sheet
+MAX_PREVIEW_FRAMES = 12
+
+# Loaded FreeType fonts keyed by (path, size), least recently used first
+FONT_CACHE_SIZE = 64
+# Measured bboxes per font, dropped once the font is evicted
+BBOX_CACHE_SIZE = 4096
+
+# Rasterized word masks keyed by (text, size, path), least recently used
+# first, up to this many bytes in total
+WORD_MASK_CACHE_BYTES = 64 * 1024 * 1024
+
+# Bump when the layout code changes, so older cached plans and segment
+# layouts are not reused
+# 2: plan keys tell PIL's fallback font apart from font_path
+LAYOUT_PLAN_VERSION = 2
+# Cached layout plans are kept this many seconds
+LAYOUT_PLAN_TTL = 30 * 24 * 60 * 60
+
+_font_cache = OrderedDict()
+_font_cache_lock = threading.Lock()
+_bbox_cache = weakref.WeakKeyDictionary()
+_mask_cache = OrderedDict()
+_mask_cache_bytes = 0
+_mask_cache_lock = threading.Lock()
+_cache_stats = {"font_hits": 0, "font_misses": 0,
+                "bbox_hits": 0, "bbox_misses": 0,
+                "mask_hits": 0, "mask_misses": 0}
+
+
+def get_font(size, font_path=FONT_PATH):
+    """
+    Returns the font for (font_path, size) from a bounded LRU cache,
+    loading it on a miss. Falls back to PIL's default font.
+    """
+    key = (font_path, size)
+    with _font_cache_lock:
+        font = _font_cache.get(key)
+        if font is not None:
+            _font_cache.move_to_end(key)
+            _cache_stats["font_hits"] += 1
+            return font
+        _cache_stats["font_misses"] += 1
+
+    try:
+        font = ImageFont.truetype(font_path, size)
+    except:
+        font = ImageFont.load_default()
+
+    with _font_cache_lock:
+        _font_cache[key] = font
+        while len(_font_cache) > FONT_CACHE_SIZE:
+            _font_cache.popitem(last=False)
+    return font
+
+
+def get_text_bbox(font, text):
+    """
+    Cached font.getbbox(text). The cache lives as long as the font does.
+    """
+    cache = _bbox_cache.get(font)
+    if cache is None:
+        cache = {}
+        _bbox_cache[font] = cache
+
+    bbox = cache.get(text)
+    if bbox is not None:
+        _cache_stats["bbox_hits"] += 1
+        return bbox
+
+    _cache_stats["bbox_misses"] += 1
+    if len(cache) >= BBOX_CACHE_SIZE:
+        cache.clear()
+    bbox = font.getbbox(text)
+    cache[text] = bbox
+    return bbox
+
+
+def get_text_width(font, text):
+    """Advance width of text as used by the layout code (bbox right edge)."""
+    return get_text_bbox(font, text)[2]
+
+
+def get_word_mask(text, font_size, font_path=FONT_PATH):
+    """
+    Returns (left, top, mask) for text drawn at font_size: mask is the
+    text's coverage (0-255) as a read-only array, to be placed at
+    (x + left, y + top) for text drawn at (x, y). Masks are rasterized
+    once and kept in a bounded LRU cache; they do not depend on colours.
+    """
+    global _mask_cache_bytes
+    key = (text, font_size, font_path)
+    with _mask_cache_lock:
+        entry = _mask_cache.get(key)
+        if entry is not None:
+            _mask_cache.move_to_end(key)
+            _cache_stats["mask_hits"] += 1
+            return entry
+        _cache_stats["mask_misses"] += 1
+
+    font = get_font(font_size, font_path)
+    left, top, right, bottom = get_text_bbox(font, text)
+    image = Image.new('L', (max(1, right - left), max(1, bottom - top)), color=0)
+    ImageDraw.Draw(image).text((-left, -top), text, font=font, fill=255)
+    entry = (left, top, np.asarray(image))
+
+    with _mask_cache_lock:
+        if key not in _mask_cache:
+            _mask_cache[key] = entry
+            _mask_cache_bytes += entry[2].nbytes
+        while _mask_cache_bytes > WORD_MASK_CACHE_BYTES and len(_mask_cache) > 1:
+            _, (_, _, evicted) = _mask_cache.popitem(last=False)
+            _mask_cache_bytes -= evicted.nbytes
+    return entry
+
+
+def font_cache_stats():
+    """Returns hit/miss counters for the font, metrics and mask caches."""
+    stats = dict(_cache_stats)
+    stats["fonts_cached"] = len(_font_cache)
+    stats["masks_cached"] = len(_mask_cache)
+    return stats
+
 
 def get_wrapped_lines(words, font, max_width):
     """
@@ -16,11 +163,11 @@ def get_wrapped_lines(words, font, max_width):
     current_line = []
 
     # We measure space width for calculation
-    space_width = font.getbbox(" ")[2]
+    space_width = get_text_width(font, " ")
     current_width = 0
 
     for word_text in words:
-        word_width = font.getbbox(word_text)[2]
+        word_width = get_text_width(font, word_text)
 
         if not current_line:
             current_line.append(word_text)
@@ -51,7 +198,7 @@ def calculate_layout_metrics(lines, font):
     total_height = 0
     line_heights = []
 
-    bbox_ref = font.getbbox("Ay")
+    bbox_ref = get_text_bbox(font, "Ay")
     base_line_height = bbox_ref[3] - bbox_ref[1]
 
     line_spacing = 10
@@ -60,7 +207,7 @@ def calculate_layout_metrics(lines, font):
         if not line_words:
             continue
         line_str = " ".join(line_words)
-        w = font.getbbox(line_str)[2]
+        w = get_text_width(font, line_str)
         max_line_width = max(max_line_width, w)
         line_heights.append(base_line_height)
         total_height += base_line_height
@@ -74,22 +221,94 @@ def get_optimal_font_size(words, max_size, min_font=20, max_font=400):
     """
     Binary search for font size.
     Wraps text at each size and checks against max_size.
+
+    The search runs on estimated fits for all sizes at once (see
+    _SizeEstimator); only the sizes around its answer are wrapped with
+    real metrics.
     """
-    font_path = "arial.ttf"
     target_width = max_size[0] - 100  # Padding horizontal
     # This is already the constrained height passing in
     target_height = max_size[1]
 
     def check_fit(size):
-        try:
-            font = ImageFont.truetype(font_path, size)
-        except:
-            font = ImageFont.load_default()
-
+        font = get_font(size)
         lines = get_wrapped_lines(words, font, target_width)
         w, h, _, _ = calculate_layout_metrics(lines, font)
         return w <= target_width and h <= target_height
 
+    estimator = _SizeEstimator.create(target_width, target_height, min_font, max_font)
+    if estimator is not None:
+        for word_text in words:
+            estimator.add(word_text)
+        return solve_font_size(estimator.fits(), check_fit, min_font, max_font)
+    return search_font_size(check_fit, min_font, max_font)
+
+
+# Steps from the estimated font size that solve_font_size will confirm
+# before falling back to a full search with real metrics
+MAX_CONFIRM_STEPS = 8
+
+
+class _SizeEstimator:
+    """
+    Greedy line wrapping of a growing word list at every font size from
+    min_font to max_font at once. Word widths are measured once at
+    max_font and scaled linearly to the other sizes, so the fits are an
+    estimate of what _WrapState finds: hinting moves real widths by a
+    pixel or two.
+    """
+
+    def __init__(self, font, max_width, max_height, min_font, max_font):
+        self.font = font
+        self.max_width = max_width
+        self.max_height = max_height
+        self.scale = np.arange(min_font, max_font + 1) / max_font
+        self.space_width = get_text_width(font, " ") * self.scale
+        bbox_ref = get_text_bbox(font, "Ay")
+        self.line_height = (bbox_ref[3] - bbox_ref[1]) * self.scale
+
+        self.current_width = np.zeros_like(self.scale)
+        self.closed_width = np.zeros_like(self.scale)  # widest line before the last one
+        self.lines = np.zeros(len(self.scale), dtype=np.int64)
+
+    @classmethod
+    def create(cls, max_width, max_height, min_font, max_font, font_path=FONT_PATH):
+        """
+        Returns an estimator, or None where widths do not scale with the
+        size (no sizes to try, or PIL's fixed-size fallback font).
+        """
+        if max_font < min_font:
+            return None
+        font = get_font(max_font, font_path)
+        if getattr(font, 'size', None) != max_font:
+            return None
+        return cls(font, max_width, max_height, min_font, max_font)
+
+    def add(self, text):
+        word_width = get_text_width(self.font, text) * self.scale
+        if not self.lines[0]:
+            self.current_width = word_width
+            self.lines += 1
+            return
+
+        new_width = self.current_width + self.space_width + word_width
+        fits = new_width <= self.max_width
+        np.maximum(self.closed_width, np.where(fits, 0, self.current_width), out=self.closed_width)
+        self.current_width = np.where(fits, new_width, word_width)
+        self.lines += ~fits
+
+    def fits(self):
+        """Estimated fit of each size, indexed by size - min_font."""
+        width = np.maximum(self.closed_width, self.current_width)
+        height = self.line_height * self.lines + 10 * np.maximum(self.lines - 1, 0)
+        return (width <= self.max_width) & (height <= self.max_height)
+
+
+def search_font_size(check_fit, min_font, max_font):
+    """
+    Binary search for the largest size check_fit accepts between min_font
+    and max_font. Returns min_font if no probed size fits.
+    """
     low, high = min_font, max_font
     best_size = min_font
 
@@ -104,73 +323,221 @@ def get_optimal_font_size(words, max_size, min_font=20, max_font=400):
     return best_size
 
 
+def solve_font_size(estimated_fits, check_fit, min_font, max_font):
+    """
+    search_font_size, run on estimated_fits (indexed by size - min_font)
+    instead of real metrics. The answer is then confirmed with check_fit
+    and moved to the nearest size where the real fit changes, so it
+    matches the full search wherever the fit is monotonic around it.
+    """
+    best_size = search_font_size(
+        lambda size: bool(estimated_fits[size - min_font]), min_font, max_font)
+
+    if check_fit(best_size):
+        for _ in range(MAX_CONFIRM_STEPS):
+            if best_size == max_font or not check_fit(best_size + 1):
+                return best_size
+            best_size += 1
+    else:
+        for _ in range(MAX_CONFIRM_STEPS):
+            if best_size == min_font:
+                return best_size
+            best_size -= 1
+            if check_fit(best_size):
+                return best_size
+
+    # The estimate was far off
+    return search_font_size(check_fit, min_font, max_font)
+
+
 def calculate_word_positions(lines, font_size, size):
     """
     Calculates absolute positions with Justified Alignment.
     """
-    try:
-        font = ImageFont.truetype("arial.ttf", font_size)
-    except:
-        font = ImageFont.load_default()
+    font = get_font(font_size)
 
     _, total_text_height, line_heights, line_spacing = calculate_layout_metrics(
         lines, font)
 
-    MAX_WIDTH = size[0] - 100  # Match padding used in sizing
-    start_x = 50  # Padding left
-
     # FIXED TOP ALIGNMENT (User Request)
     # Start at 20% height
     start_y = int(size[1] * 0.2)
     current_y = start_y
-    space_width = font.getbbox(" ")[2]
 
-    target_width = MAX_WIDTH
     word_positions = []
 
     for i, line_words in enumerate(lines):
-        # Determine Alignment
         is_last_line = (i == len(lines) - 1)
+        word_positions.extend(calculate_line_positions(
+            line_words, is_last_line, current_y, font, size))
+
+        current_y += line_heights[i] + line_spacing
+
+    return word_positions, font
+
+
+def calculate_line_positions(line_words, is_last_line, y, font, size):
+    """
+    Positions the words of a single line at height y.
+    """
+    MAX_WIDTH = size[0] - 100  # Match padding used in sizing
+    start_x = 50  # Padding left
+    space_width = get_text_width(font, " ")
 
-        # Calculate natural width (with normal spaces) to check fullness
-        sum_word_w = sum(font.getbbox(w)[2] for w in line_words)
-        normal_gap_w = (len(line_words) - 1) * space_width
-        natural_width = sum_word_w + normal_gap_w
-
-        # Threshold: If line is >85% full, justify it even if last line
-        # to avoid jump when wrapping.
-        is_full_enough = (natural_width / target_width) > 0.85
-
-        should_left_align = (
-            is_last_line and not is_full_enough) or len(line_words) == 1
-
-        if should_left_align:
-            # Left Align
-            curr_x = start_x
-            for w in line_words:
-                w_w = font.getbbox(w)[2]
-                word_positions.append({'text': w, 'x': curr_x, 'y': current_y})
-                curr_x += w_w + space_width
+    target_width = MAX_WIDTH
+    word_positions = []
+
+    # Calculate natural width (with normal spaces) to check fullness
+    sum_word_w = sum(get_text_width(font, w) for w in line_words)
+    normal_gap_w = (len(line_words) - 1) * space_width
+    natural_width = sum_word_w + normal_gap_w
+
+    # Threshold: If line is >85% full, justify it even if last line
+    # to avoid jump when wrapping.
+    is_full_enough = (natural_width / target_width) > 0.85
+
+    should_left_align = (
+        is_last_line and not is_full_enough) or len(line_words) == 1
+
+    if should_left_align:
+        # Left Align
+        curr_x = start_x
+        for w in line_words:
+            w_w = get_text_width(font, w)
+            word_positions.append({'text': w, 'x': curr_x, 'y': y})
+            curr_x += w_w + space_width
+    else:
+        # Justify Align
+        available_space = target_width - sum_word_w
+
+        if len(line_words) > 1:
+            gap = available_space / (len(line_words) - 1)
         else:
-            # Justify Align
-            available_space = target_width - sum_word_w
+            gap = 0
+
+        curr_x = (size[0] - target_width) // 2  # Centered block
+
+        for index, w in enumerate(line_words):
+            w_w = get_text_width(font, w)
+            word_positions.append(
+                {'text': w, 'x': int(curr_x), 'y': y})
+            curr_x += w_w + gap
+
+    return word_positions
 
-            if len(line_words) > 1:
-                gap = available_space / (len(line_words) - 1)
+
+class _WrapState:
+    """
+    Greedy line wrapping of a growing word list at one font size.
+    Mirrors get_wrapped_lines + calculate_layout_metrics, but only the
+    words added since the last call are processed.
+    """
+
+    def __init__(self, font, max_width):
+        self.font = font
+        self.max_width = max_width
+        self.space_width = get_text_width(font, " ")
+        bbox_ref = get_text_bbox(font, "Ay")
+        self.line_height = bbox_ref[3] - bbox_ref[1]
+        self.lines = []
+        self.count = 0
+        self.current_width = 0
+        self.closed_width = 0  # widest line before the last one
+        self.last_width = 0
+
+    def extend(self, words):
+        font = self.font
+        for word_text in words[self.count:]:
+            word_width = get_text_width(font, word_text)
+            new_width = self.current_width + self.space_width + word_width
+
+            if self.lines and new_width <= self.max_width:
+                self.lines[-1].append(word_text)
+                self.current_width = new_width
             else:
-                gap = 0
+                if self.lines:
+                    self.closed_width = max(self.closed_width, self.last_width)
+                self.lines.append([word_text])
+                self.current_width = word_width
 
-            curr_x = (size[0] - target_width) // 2  # Centered block
+        if self.count != len(words):
+            self.count = len(words)
+            self.last_width = get_text_width(font, " ".join(self.lines[-1]))
 
-            for index, w in enumerate(line_words):
-                w_w = font.getbbox(w)[2]
-                word_positions.append(
-                    {'text': w, 'x': int(curr_x), 'y': current_y})
-                curr_x += w_w + gap
+    def metrics(self):
+        n = len(self.lines)
+        width = max(self.closed_width, self.last_width)
+        height = self.line_height * n + (10 * (n - 1) if n else 0)
+        return width, height
 
-        current_y += line_heights[i] + line_spacing
 
-    return word_positions, font
+class IncrementalLayout:
+    """
+    Layout of a lyric segment that grows one word at a time.
+
+    Produces the same font size and word positions as running
+    get_optimal_font_size + get_wrapped_lines + calculate_word_positions
+    on every prefix, but keeps the wrapping for each probed font size and
+    the positions of unchanged lines between calls.
+    """
+
+    def __init__(self, size, max_text_height, min_font=20, max_font=400):
+        self.size = size
+        self.target_width = size[0] - 100
+        self.target_height = max_text_height
+        self.min_font = min_font
+        self.max_font = max_font
+        self.words = []
+        self._wraps = {}
+        self._line_positions = {}
+        self._estimator = _SizeEstimator.create(
+            self.target_width, self.target_height, min_font, max_font)
+
+    def _check_fit(self, font_size):
+        state = self._wraps.get(font_size)
+        if state is None:
+            state = _WrapState(get_font(font_size), self.target_width)
+            self._wraps[font_size] = state
+        state.extend(self.words)
+        w, h = state.metrics()
+        return w <= self.target_width and h <= self.target_height
+
+    def add_word(self, text):
+        """
+        Appends a word and returns (font_size, word_positions, font)
+        for the words added so far.
+        """
+        self.words.append(text)
+
+        # Same search as get_optimal_font_size
+        if self._estimator is not None:
+            self._estimator.add(text)
+            best_size = solve_font_size(self._estimator.fits(), self._check_fit,
+                                        self.min_font, self.max_font)
+        else:
+            best_size = search_font_size(
+                self._check_fit, self.min_font, self.max_font)
+
+        self._check_fit(best_size)
+        state = self._wraps[best_size]
+        font = state.font
+
+        current_y = int(self.size[1] * 0.2)
+        word_positions = []
+
+        for i, line_words in enumerate(state.lines):
+            is_last_line = (i == len(state.lines) - 1)
+            key = (best_size, i, len(line_words), is_last_line)
+            positions = self._line_positions.get(key)
+            if positions is None:
+                positions = calculate_line_positions(
+                    line_words, is_last_line, current_y, font, self.size)
+                self._line_positions[key] = positions
+            word_positions.extend(positions)
+
+            current_y += state.line_height + 10
+
+        return best_size, word_positions, font
 
 
 def create_text_image(text, size=(1080, 1920), bg_color=(255, 255, 255), text_color=(0, 0, 0), font_path="arial.ttf", font_size=100):
@@ -179,6 +546,10 @@ def create_text_image(text, size=(1080, 1920), bg_color=(255, 255, 255), text_co
 
 
 def create_frame(word_positions, visible_count, size, bg_color, font, text_color, lofi_factor=1):
+    if lofi_factor > 1:
+        return create_lofi_frame(word_positions, visible_count, size, bg_color,
+                                 font, text_color, lofi_factor)
+
     img = Image.new('RGB', size, color=bg_color)
     draw = ImageDraw.Draw(img)
 
@@ -187,50 +558,180 @@ def create_frame(word_positions, visible_count, size, bg_color, font, text_color
         draw.text((item['x'], item['y']), item['text'],
                   font=font, fill= text_color)
 
-    if lofi_factor > 1:
-        small_size = (max(1, size[0] // lofi_factor),
-                      max(1, size[1] // lofi_factor))
-        img = img.resize(small_size, Image.BILINEAR)
-        img = img.resize(size, Image.NEAREST)
-
     return np.array(img)
 
 
-def generate_video(audio_path, output_path, lyrics_path=None, bg_color_hex="#FFFFFF", max_font_size=400, lofi_factor=1, text_color_hex="#000000"):
-    VIDEO_SIZE = (1080, 1920)
-    # Define effective text area
-    # 20% top padding, 20% bottom padding -> 60% height usable
-    MAX_TEXT_HEIGHT = VIDEO_SIZE[1] * 0.6
+@functools.lru_cache(maxsize=32)
+def blend_palette(bg_color, text_color):
+    """
+    256-entry RGB lookup table from text coverage (0-255) to the
+    colour of text_color blended over bg_color.
+    """
+    alpha = np.arange(256, dtype=np.float32)[:, None] / 255
+    bg = np.array(bg_color, dtype=np.float32)
+    fg = np.array(text_color, dtype=np.float32)
+    palette = np.rint(bg + (fg - bg) * alpha).astype(np.uint8)
+    palette.flags.writeable = False
+    return palette
 
-    bg_color = tuple(int(bg_color_hex.lstrip(
-        '#')[i:i+2], 16) for i in (0, 2, 4))
-    text_color = tuple(int(text_color_hex.lstrip(
-        '#')[i:i+2], 16) for i in (0, 2, 4))
 
-    # Load audio early to get duration
-    try:
-        audio = AudioFileClip(audio_path)
-    except Exception as e:
-        print(f"Error loading audio: {e}")
-        return
+def create_lofi_frame(word_positions, visible_count, size, bg_color, font, text_color, lofi_factor):
+    """
+    Pixelated frame. The text is drawn as a single-channel coverage mask,
+    only that mask is downscaled, and colours are applied through a
+    palette on the small image before the NEAREST upscale. Within one
+    level of drawing in RGB and resizing the full frame, at about half the
+    cost.
+    """
+    mask = Image.new('L', size, color=0)
+    draw = ImageDraw.Draw(mask)
 
-    raw_lyrics = []
+    for i in range(min(visible_count, len(word_positions))):
+        item = word_positions[i]
+        draw.text((item['x'], item['y']), item['text'], font=font, fill=255)
 
-    if lyrics_path:
-        try:
-            with open(lyrics_path, 'r', encoding='utf-8') as f:
-                raw_lyrics = json.load(f)
-        except Exception as e:
-            print(f"Error loading lyrics file: {e}")
-            return
-    else:
-        print("Error: Must provide --lyrics file.")
-        return
+    small_size = (max(1, size[0] // lofi_factor),
+                  max(1, size[1] // lofi_factor))
+    small = np.asarray(mask.resize(small_size, Image.BILINEAR))
+    small = Image.fromarray(blend_palette(bg_color, text_color)[small])
+
+    return np.asarray(small.resize(size, Image.NEAREST))
 
-    clips = []
 
-    # Pre-process: Convert Line-based input to Word-based segments
-    # Input: [ {"start": 0.0, "text": "Line 1"}, {"start": 3.0, "text": "Line 2"} ]
+class FrameComposer:
+    """
+    Builds frames for one size and style from cached word masks.
+
+    Text coverage is kept in a single reused buffer. When a frame shows
+    the previous frame's words at the same font size plus some more, only
+    the new words are blitted, and only the area around them is coloured
+    (and, with lofi_factor > 1, pixelated) again; anything else clears
+    the buffer first. Colours are applied through blend_palette, so a
+    composer for another style reuses the same masks without rasterizing
+    anything. Matches create_frame except where glyph boxes overlap.
+    """
+
+    def __init__(self, size, bg_color, text_color, lofi_factor=1, font_path=FONT_PATH):
+        self.size = size
+        self.lofi_factor = lofi_factor
+        self.font_path = font_path
+        self._palette = blend_palette(tuple(bg_color), tuple(text_color))
+        self._coverage = np.zeros((size[1], size[0]), dtype=np.uint8)
+        # Copying this is much faster than broadcasting a colour over _frame
+        self._background = np.empty((size[1], size[0], 3), dtype=np.uint8)
+        self._background[:] = self._palette[0]
+        self._frame = self._background.copy()
+        self._lock = threading.Lock()
+        self._font_size = None
+        self._drawn = []
+        # Area of the coverage changed since the frame was last coloured
+        self._dirty = None
+
+        if lofi_factor > 1:
+            small_w = max(1, size[0] // lofi_factor)
+            small_h = max(1, size[1] // lofi_factor)
+            self._small = np.zeros((small_h, small_w), dtype=np.uint8)
+            # How many output rows/columns each small pixel covers in a
+            # NEAREST upscale, and where each one starts
+            self._rows = np.bincount(
+                np.minimum(((np.arange(size[1]) + 0.5) * small_h / size[1]).astype(int), small_h - 1),
+                minlength=small_h)
+            self._cols = np.bincount(
+                np.minimum(((np.arange(size[0]) + 0.5) * small_w / size[0]).astype(int), small_w - 1),
+                minlength=small_w)
+            self._row_starts = np.concatenate(([0], np.cumsum(self._rows)))
+            self._col_starts = np.concatenate(([0], np.cumsum(self._cols)))
+
+        self._clear()
+
+    def _clear(self):
+        self._coverage.fill(0)
+        np.copyto(self._frame, self._background)
+        if self.lofi_factor > 1:
+            self._small.fill(0)
+        self._drawn = []
+        self._dirty = None
+
+    def render(self, word_positions, font_size):
+        """Returns a new RGB array showing word_positions at font_size."""
+        # The buffers carry over between calls, so callers sharing this
+        # composer (preview threads) take turns
+        with self._lock:
+            drawn = len(self._drawn)
+            if font_size != self._font_size or word_positions[:drawn] != self._drawn:
+                self._clear()
+                self._font_size = font_size
+                drawn = 0
+
+            for item in word_positions[drawn:]:
+                self._blit(item)
+                self._drawn.append(item)
+
+            if self._dirty is not None:
+                if self.lofi_factor > 1:
+                    self._pixelate(*self._dirty)
+                else:
+                    x0, y0, x1, y1 = self._dirty
+                    # take is a good deal faster than indexing with an array
+                    np.take(self._palette, self._coverage[y0:y1, x0:x1], axis=0,
+                            out=self._frame[y0:y1, x0:x1])
+                self._dirty = None
+            return self._frame.copy()
+
+    def _blit(self, item):
+        left, top, mask = get_word_mask(item['text'], self._font_size, self.font_path)
+        x0, y0 = item['x'] + left, item['y'] + top
+        # Clip to the frame
+        fx0, fy0 = max(x0, 0), max(y0, 0)
+        fx1 = min(x0 + mask.shape[1], self.size[0])
+        fy1 = min(y0 + mask.shape[0], self.size[1])
+        if fx0 >= fx1 or fy0 >= fy1:
+            return
+
+        region = self._coverage[fy0:fy1, fx0:fx1]
+        np.maximum(region, mask[fy0 - y0:fy1 - y0, fx0 - x0:fx1 - x0], out=region)
+        if self._dirty is None:
+            self._dirty = (fx0, fy0, fx1, fy1)
+        else:
+            dx0, dy0, dx1, dy1 = self._dirty
+            self._dirty = (min(dx0, fx0), min(dy0, fy0), max(dx1, fx1), max(dy1, fy1))
+
+    def _pixelate(self, x0, y0, x1, y1):
+        # As create_lofi_frame (BILINEAR downscale, colour, NEAREST
+        # upscale), redone only for the small pixels whose filter window
+        # reaches the changed area. Resizing a box of the coverage gives
+        # exactly those pixels of the full downscale.
+        small_h, small_w = self._small.shape
+        scale_x = self.size[0] / small_w
+        scale_y = self.size[1] / small_h
+        j0 = max(0, math.floor(x0 / scale_x) - 2)
+        j1 = min(small_w, math.ceil(x1 / scale_x) + 2)
+        i0 = max(0, math.floor(y0 / scale_y) - 2)
+        i1 = min(small_h, math.ceil(y1 / scale_y) + 2)
+
+        box = (j0 * scale_x, i0 * scale_y, j1 * scale_x, i1 * scale_y)
+        small = np.asarray(Image.fromarray(self._coverage).resize(
+            (j1 - j0, i1 - i0), Image.BILINEAR, box=box))
+        self._small[i0:i1, j0:j1] = small
+
+        colored = np.take(self._palette, small, axis=0)
+        self._frame[self._row_starts[i0]:self._row_starts[i1],
+                    self._col_starts[j0]:self._col_starts[j1]] = \
+            colored.repeat(self._rows[i0:i1], axis=0).repeat(self._cols[j0:j1], axis=1)
+
+
+@functools.lru_cache(maxsize=4)
+def get_composer(size, bg_color, text_color, lofi_factor=1):
+    """This process's FrameComposer for a size and style, shared by its threads."""
+    return FrameComposer(size, bg_color, text_color, lofi_factor)
+
+
+def build_segments(raw_lyrics, audio_duration):
+    """
+    Converts line-based lyrics into word-based segments.
+    Input: [ {"start": 0.0, "text": "Line 1"}, {"start": 3.0, "text": "Line 2"} ]
+    Output: [ {"words": [{"time": 0.0, "text": "Line"}, ...]}, ... ]
+    """
     processed_segments = []
 
     for i, line_item in enumerate(raw_lyrics):
@@ -242,7 +743,7 @@ def generate_video(audio_path, output_path, lyrics_path=None, bg_color_hex="#FFF
             next_start = float(raw_lyrics[i+1].get('start', 0.0))
             end_time = next_start
         else:
-            end_time = audio.duration
+            end_time = audio_duration
 
         duration = end_time - start_time
         if duration <= 0:
@@ -264,74 +765,659 @@ def generate_video(audio_path, output_path, lyrics_path=None, bg_color_hex="#FFF
 
         processed_segments.append({"words": segment_words})
 
-    # Main Loop (using processed segments)
+    return processed_segments
+
+
+def layout_font_id(max_font_size=400, font_path=FONT_PATH):
+    """
+    Font part of layout cache keys: font_path, or "default" when
+    get_font falls back to PIL's fixed-size font, so layouts made with
+    it never pass for layouts made with the real font.
+    """
+    font = get_font(max_font_size, font_path)
+    return font_path if getattr(font, 'size', None) == max_font_size else "default"
+
+
+def segment_layout_key(words, size, max_text_height, max_font_size=400, font_path=FONT_PATH):
+    """SegmentLayoutCache key of a segment's layout."""
+    return SegmentLayoutCache.make_key(words, layout_font_id(max_font_size, font_path), max_font_size,
+                                       size, max_text_height, LAYOUT_PLAN_VERSION)
+
+
+def layout_segment(words, size, max_text_height, max_font_size=400, segment_cache=None):
+    """
+    Lays out every prefix of a segment's words.
+    Returns a list of (font_size, word_positions), one per word.
+
+    With a segment_cache (a SegmentLayoutCache), a segment laid out
+    before, by any process, is read back instead.
+    """
+    if segment_cache is not None:
+        key = segment_layout_key(words, size, max_text_height, max_font_size)
+        cached = segment_cache.get(key)
+        if cached is not None:
+            return [(font_size, [{'text': text, 'x': x, 'y': y}
+                                 for text, (x, y) in zip(words, xy)])
+                    for font_size, xy in cached]
+
+    layout = IncrementalLayout(size, max_text_height, max_font=max_font_size)
+    frames = []
+    for word_text in words:
+        best_font_size, word_positions, _ = layout.add_word(word_text)
+        frames.append((best_font_size, word_positions))
+
+    if segment_cache is not None:
+        # Words are stored once in the key; positions keep x and y only
+        segment_cache.put(key, [[font_size, [[item['x'], item['y']] for item in word_positions]]
+                                for font_size, word_positions in frames])
+    return frames
+
+
+def iter_timeline(processed_segments, audio_duration, size, max_text_height, max_font_size=400, executor=None, segment_cache=None):
+    """
+    Lays out the video one frame at a time.
+    Yields dicts with 'start', 'duration', 'positions', 'font_size' and
+    'font', one per word, in timeline order.
+
+    With an executor, segments are laid out in parallel and yielded in
+    order as they complete. With a segment_cache, segments laid out
+    before are read back from it.
+    """
+    for segment in processed_segments:
+        segment.get('words', []).sort(key=lambda x: x['time'])
+
+    def segment_args(segment):
+        words = [w['text'] for w in segment.get('words', [])]
+        return (words, size, max_text_height, max_font_size, segment_cache)
+
+    if executor is not None:
+        layouts = [executor.submit(layout_segment, *segment_args(segment))
+                   for segment in processed_segments]
+
     for segment_idx, segment in enumerate(processed_segments):
         words_data = segment.get('words', [])
         if not words_data:
             continue
 
-        words_data.sort(key=lambda x: x['time'])
-
-        # We now calculate layout PER FRAME (per word addition)
+        # We now calculate layout PER FRAME (per word addition),
+        # reusing the previous frame's wrapping where possible
+        if executor is not None:
+            segment_layout = layouts[segment_idx].result()
+            layouts[segment_idx] = None
+        else:
+            segment_layout = layout_segment(*segment_args(segment))
 
         for i, word_item in enumerate(words_data):
-            # 1. Get currently visible words
-            current_visible_data = words_data[:i+1]
-            current_words_text = [w['text'] for w in current_visible_data]
-
-            # 2. Optimal Font Size for CURRENT text
-            # We pass (WIDTH, MAX_TEXT_HEIGHT) to constrain logic
-            best_font_size = get_optimal_font_size(
-                current_words_text, (VIDEO_SIZE[0], MAX_TEXT_HEIGHT), max_font=max_font_size)
-
-            try:
-                font = ImageFont.truetype("arial.ttf", best_font_size)
-            except:
-                font = ImageFont.load_default()
-
-            # 3. Calculate Layout for CURRENT text
-            lines = get_wrapped_lines(
-                current_words_text, font, VIDEO_SIZE[0] - 100)
-            word_positions, _ = calculate_word_positions(
-                lines, best_font_size, VIDEO_SIZE)
-
-            # Timing logic
+            best_font_size, word_positions = segment_layout[i]
+
+            # Timing logic: hold until the next word, or the next segment
             start_time = word_item['time']
             if i < len(words_data) - 1:
                 end_time = words_data[i+1]['time']
-                duration = end_time - start_time
             else:
                 if segment_idx < len(processed_segments) - 1:
                     next_seg = processed_segments[segment_idx+1]
                     if next_seg.get('words'):
                         end_time = next_seg['words'][0]['time']
                     else:
-                        end_time = audio.duration
+                        end_time = audio_duration
                 else:
-                    end_time = audio.duration
+                    end_time = audio_duration
 
+            duration = end_time - start_time
             if duration <= 0:
                 duration = 0.05
 
-            # Draw frame
-            img_array = create_frame(word_positions, len(
-                word_positions), VIDEO_SIZE, bg_color,  font, text_color, lofi_factor=lofi_factor)
-            clip = ImageClip(img_array).set_duration(
-                duration).set_start(start_time)
-            clips.append(clip)
+            yield {
+                'start': start_time,
+                'duration': duration,
+                'positions': word_positions,
+                'font_size': best_font_size,
+                'font': get_font(best_font_size),
+            }
+
+
+def layout_plan_key(raw_lyrics, audio_duration, size, max_text_height, max_font_size=400, font_path=FONT_PATH):
+    """
+    Cache key of the layout plan for these lyrics and layout settings.
+    Colours and lofi_factor are left out: they do not change the layout.
+    """
+    key = {
+        'version': LAYOUT_PLAN_VERSION,
+        'lyrics': raw_lyrics,
+        'audio_duration': audio_duration,
+        'size': list(size),
+        'max_text_height': max_text_height,
+        'max_font_size': max_font_size,
+        'font': layout_font_id(max_font_size, font_path),
+    }
+    encoded = json.dumps(key, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def build_layout_plan(processed_segments, audio_duration, size, max_text_height, max_font_size=400, executor=None, segment_cache=None):
+    """
+    Runs the whole layout pass and returns it as a JSON-serializable plan:
+    a dict whose 'entries' are the timeline entries ('start', 'duration',
+    'positions', 'font_size') in order. A plan can be rendered with any
+    colours and lofi_factor.
+    """
+    entries = [{'start': entry['start'],
+                'duration': entry['duration'],
+                'positions': entry['positions'],
+                'font_size': entry['font_size']}
+               for entry in iter_timeline(processed_segments, audio_duration, size, max_text_height,
+                                          max_font_size=max_font_size, executor=executor,
+                                          segment_cache=segment_cache)]
+    return {'version': LAYOUT_PLAN_VERSION, 'size': list(size), 'entries': entries}
+
+
+def render_timeline_entry(positions, font_size, size, bg_color, text_color, lofi_factor=1):
+    """
+    Rasterizes one timeline entry. Module level so it can run in a
+    process pool; each process composes frames from its own mask cache.
+    """
+    composer = get_composer(tuple(size), tuple(bg_color), tuple(text_color), lofi_factor)
+    return composer.render(positions, font_size)
+
+
+def process_pool(max_workers):
+    """
+    Process pool for layout and frame work. Its processes are spawned,
+    not forked: pools start them lazily, and a process forked while an
+    encoder is running would inherit the pipe into ffmpeg's stdin and
+    keep ffmpeg from ever seeing EOF.
+    """
+    return ProcessPoolExecutor(max_workers=max_workers,
+                               mp_context=multiprocessing.get_context("spawn"))
 
-    # Create Background Clip
-    background_clip = ColorClip(
-        size=VIDEO_SIZE, color=bg_color).set_duration(audio.duration)
 
-    final_video = CompositeVideoClip(
-        [background_clip] + clips, size=VIDEO_SIZE)
+def prerender_timeline(timeline, executor, window, *render_args):
+    """
+    Rasterizes timeline entries in the executor ahead of the encoder.
+    Yields the entries in order with the array under 'frame'; at most
+    `window` frames are in flight at once.
+    """
+    pending = deque()
+    for entry in timeline:
+        future = executor.submit(
+            render_timeline_entry, entry['positions'], entry['font_size'], *render_args)
+        pending.append((entry, future))
+
+        if len(pending) >= window:
+            done_entry, done_future = pending.popleft()
+            done_entry['frame'] = done_future.result()
+            yield done_entry
+
+    while pending:
+        done_entry, done_future = pending.popleft()
+        done_entry['frame'] = done_future.result()
+        yield done_entry
+
+
+class TimelineCursor:
+    """
+    Finds the timeline entry on screen at time t, for non-decreasing t.
+
+    Entries are pulled from the (possibly lazy) timeline only once their
+    start time is reached and dropped once they end, so only the entries
+    currently on screen are held. Where entries overlap the later one
+    wins, as in a CompositeVideoClip.
+    """
+
+    def __init__(self, timeline):
+        self._entries = iter(timeline)
+        self._pending = next(self._entries, None)
+        self._active = []
+
+    def visible_at(self, t):
+        while self._pending is not None and self._pending['start'] <= t:
+            self._active.append(self._pending)
+            self._pending = next(self._entries, None)
+
+        self._active = [e for e in self._active
+                        if t < e['start'] + e['duration']]
+        return self._active[-1] if self._active else None
+
+
+def frame_count(duration, fps):
+    """Number of frames needed to cover duration seconds at fps."""
+    return math.ceil(duration * fps)
+
+
+def iter_timeline_frames(timeline, audio_duration, fps, render_frame, background, start_frame=0, end_frame=None):
+    """
+    Yields one array per output frame at the given fps.
+
+    Each timeline entry is rendered when it first becomes visible and
+    repeated for as long as it is on screen; the previous frame is released
+    as soon as the next one is rendered. Where no entry is visible the
+    background frame is used.
+
+    start_frame/end_frame select a range of frame indices; frame k is
+    always sampled at k / fps, so chunks line up with a full render.
+    """
+    cursor = TimelineCursor(timeline)
+    current_entry = None
+    current_frame = background
+
+    if end_frame is None:
+        end_frame = frame_count(audio_duration, fps)
+
+    for t in np.arange(start_frame, end_frame) / fps:
+        entry = cursor.visible_at(t)
+
+        if entry is not current_entry:
+            current_entry = entry
+            current_frame = None
+            if entry is None:
+                current_frame = background
+            else:
+                current_frame = render_frame(entry)
+
+        yield current_frame
+
+
+def mux_audio_codec(audio_path):
+    """
+    Audio codec for the output: AAC input (e.g. from trim_audio) is
+    copied as is, anything else is encoded to AAC.
+    """
+    if audio_path.lower().endswith(('.m4a', '.aac')):
+        return 'copy'
+    return 'aac'
+
+
+def segment_start_times(processed_segments):
+    """Time of the first word of each non-empty segment."""
+    return [min(w['time'] for w in segment['words'])
+            for segment in processed_segments if segment.get('words')]
+
+
+def encoding_params(encoding, keyframe_times=(), fps=24, frames=None):
+    """
+    Extra ffmpeg output options for an encoding profile.
+
+    "standard" encodes every frame at the constant fps. "static" is for
+    video that only changes at word boundaries: exact repeats are dropped
+    before the encoder (variable frame rate, with at least one frame every
+    two seconds), x264 is tuned for still images and keyframes are forced
+    at the given times, normally the start of each lyric segment.
+
+    Dropping repeats also drops the held frames at the end, which would
+    stop the video up to two seconds before the audio. Given the number
+    of frames sent, the last frame kept is cloned into the final frame's
+    slot (unless that frame was kept itself), so the video lasts exactly
+    frames / fps.
+    """
+    if encoding == "standard":
+        return []
+    if encoding == "static":
+        filters = f'mpdecimate=hi=0:lo=0:frac=0:max={2 * fps}'
+        if frames:
+            # tpad clones one frame past the end; setpts moves it back
+            # into the last slot, and vfr drops it if that slot is taken
+            filters += (f',tpad=stop_mode=clone:stop=1'
+                        f',setpts=min(PTS\\,round({frames - 1}/({fps}*TB)))')
+        params = ['-vf', filters, '-fps_mode', 'vfr', '-tune', 'stillimage']
+        if keyframe_times:
+            params += ['-force_key_frames',
+                       ','.join(f"{t:.3f}" for t in keyframe_times)]
+        return params
+    raise ValueError(f"Unknown encoding profile: {encoding}")
+
+
+def render_with_ffmpeg(timeline, audio_path, audio_duration, output_path, size, render_frame, background, fps=24, output_params=None):
+    """
+    Pipes raw RGB frames straight into ffmpeg and muxes the audio in the
+    same pass, without building any moviepy clips.
+    """
+    writer = imageio_ffmpeg.write_frames(
+        output_path, size, fps=fps, codec='libx264', quality=None,
+        macro_block_size=8, audio_path=audio_path, audio_codec=mux_audio_codec(audio_path),
+        output_params=list(output_params or []))
+    writer.send(None)  # Start ffmpeg
+
+    try:
+        for frame in iter_timeline_frames(timeline, audio_duration, fps, render_frame, background):
+            writer.send(frame)
+    finally:
+        writer.close()
+
+
+def split_timeline(processed_segments, audio_duration, chunks, fps=24):
+    """
+    Splits the segments into at most `chunks` runs of roughly equal
+    duration, cutting only where a new segment starts.
+    Returns a list of dicts with 'segments', 'end_time', 'start_frame'
+    and 'end_frame'; the frame ranges tile the whole video.
+    """
+    segments = [s for s in processed_segments if s.get('words')]
+    for segment in segments:
+        segment['words'].sort(key=lambda x: x['time'])
+
+    total_frames = frame_count(audio_duration, fps)
+    cuts = [(0, 0)]  # (segment index, first frame)
+
+    for k in range(1, chunks):
+        target = audio_duration * k / chunks
+        for idx in range(cuts[-1][0] + 1, len(segments)):
+            start_time = segments[idx]['words'][0]['time']
+            if start_time < target:
+                continue
+            # Only cut where the previous segment has fully ended
+            if start_time <= segments[idx - 1]['words'][-1]['time']:
+                continue
+            start_frame = frame_count(start_time, fps)
+            while start_frame / fps < start_time:
+                start_frame += 1  # ceil can land a hair early in floats
+            if cuts[-1][1] < start_frame < total_frames:
+                cuts.append((idx, start_frame))
+            break
+
+    parts = []
+    for i, (idx, start_frame) in enumerate(cuts):
+        if i < len(cuts) - 1:
+            next_idx, end_frame = cuts[i + 1]
+            end_time = segments[next_idx]['words'][0]['time']
+        else:
+            next_idx, end_frame = len(segments), total_frames
+            end_time = audio_duration
+        parts.append({
+            'segments': segments[idx:next_idx],
+            'end_time': end_time,
+            'start_frame': start_frame,
+            'end_frame': end_frame,
+        })
+    return parts
+
+
+def encode_chunk(part, output_path, size, max_text_height, max_font_size, bg_color, text_color, lofi_factor=1, fps=24, encoding="standard", segment_cache=None):
+    """
+    Lays out, rasterizes and encodes one part from split_timeline as a
+    video-only file. Module level so it can run in a process pool.
+    """
+    if 'entries' in part:
+        timeline = part['entries']
+    else:
+        timeline = iter_timeline(part['segments'], part['end_time'], size, max_text_height,
+                                 max_font_size=max_font_size, segment_cache=segment_cache)
+    background = np.array(Image.new('RGB', size, color=bg_color))
+
+    def render_frame(entry):
+        return render_timeline_entry(entry['positions'], entry['font_size'], size,
+                                     bg_color, text_color, lofi_factor=lofi_factor)
+
+    # The chunk's own timestamps start at zero
+    offset = part['start_frame'] / fps
+    keyframe_times = [max(0.0, t - offset)
+                      for t in segment_start_times(part['segments'])]
+
+    writer = imageio_ffmpeg.write_frames(
+        output_path, size, fps=fps, codec='libx264', quality=None,
+        macro_block_size=8,
+        output_params=encoding_params(encoding, keyframe_times, fps=fps,
+                                      frames=part['end_frame'] - part['start_frame']))
+    writer.send(None)  # Start ffmpeg
+
+    try:
+        for frame in iter_timeline_frames(timeline, part['end_time'], fps, render_frame, background,
+                                          start_frame=part['start_frame'], end_frame=part['end_frame']):
+            writer.send(frame)
+    finally:
+        writer.close()
+    return output_path
+
+
+def concat_chunks(chunk_paths, durations, audio_path, output_path):
+    """
+    Joins encoded chunks with ffmpeg's concat demuxer without re-encoding
+    the video, and muxes the audio in the same pass. Each chunk is placed
+    by its nominal duration, so variable frame rate chunks whose last
+    frames were dropped still line up.
+    """
+    list_path = output_path + ".chunks.txt"
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for path, duration in zip(chunk_paths, durations):
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+            f.write(f"duration {duration:.6f}\n")
+
+    cmd = [imageio_ffmpeg.get_ffmpeg_exe(), '-y', '-loglevel', 'error',
+           '-f', 'concat', '-safe', '0', '-i', list_path,
+           '-i', audio_path, '-map', '0:v:0', '-map', '1:a:0',
+           '-c:v', 'copy', '-c:a', mux_audio_codec(audio_path), output_path]
+    try:
+        subprocess.run(cmd, check=True)
+    finally:
+        os.remove(list_path)
+
+
+def render_in_chunks(processed_segments, audio_path, audio_duration, output_path, chunks, *encode_args, fps=24, encoding="standard", entries=None, segment_cache=None):
+    """
+    Encodes the timeline as up to `chunks` parts in parallel processes,
+    cut at segment boundaries, then joins them losslessly. With the
+    entries of a layout plan, the chunks skip layout.
+    """
+    parts = split_timeline(processed_segments, audio_duration, chunks, fps=fps)
+    if entries is not None:
+        # One entry per word, in segment order
+        first = 0
+        for part in parts:
+            count = sum(len(segment['words']) for segment in part['segments'])
+            part['entries'] = entries[first:first + count]
+            first += count
+    chunk_dir = tempfile.mkdtemp(
+        prefix="chunks_", dir=os.path.dirname(os.path.abspath(output_path)))
+
+    try:
+        with process_pool(len(parts)) as executor:
+            futures = [
+                executor.submit(encode_chunk, part,
+                                os.path.join(chunk_dir, f"chunk_{i:03d}.mp4"),
+                                *encode_args, fps=fps, encoding=encoding,
+                                segment_cache=segment_cache)
+                for i, part in enumerate(parts)]
+            chunk_paths = [future.result() for future in futures]
+
+        durations = [(part['end_frame'] - part['start_frame']) / fps
+                     for part in parts]
+        concat_chunks(chunk_paths, durations, audio_path, output_path)
+    finally:
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+
+
+def render_preview(raw_lyrics, frames=None, bg_color_hex="#FFFFFF", text_color_hex="#000000", max_font_size=400, lofi_factor=1, width=270, columns=4, segment_cache=None):
+    """
+    Draws chosen frames of the lyrics, as generate_video would, into one
+    PNG contact sheet and returns its bytes. frames index the timeline
+    (one frame per word, in order) and default to the last frame of each
+    segment; each is scaled down to `width` pixels wide. Only the
+    segments holding a chosen frame are laid out.
+    """
+    bg_color = tuple(int(bg_color_hex.lstrip('#')[i:i+2], 16) for i in (0, 2, 4))
+    text_color = tuple(int(text_color_hex.lstrip('#')[i:i+2], 16) for i in (0, 2, 4))
+
+    # Timing plays no part in what a frame shows
+    segments = [segment for segment in build_segments(raw_lyrics, 0.0) if segment['words']]
+    for segment in segments:
+        segment['words'].sort(key=lambda x: x['time'])
+
+    # (segment, word) of every timeline frame
+    timeline = [(segment_idx, word_idx)
+                for segment_idx, segment in enumerate(segments)
+                for word_idx in range(len(segment['words']))]
+    if frames is None:
+        ends = itertools.accumulate(len(segment['words']) for segment in segments)
+        frames = [end - 1 for end in ends]
+    frames = list(frames)[:MAX_PREVIEW_FRAMES]
+    if not frames:
+        raise ValueError("No frames to preview")
+    for frame in frames:
+        if not 0 <= frame < len(timeline):
+            raise ValueError(f"Frame {frame} is outside the timeline (0-{len(timeline) - 1})")
+
+    scale = max(1, round(VIDEO_SIZE[0] / width))
+    thumb_size = (VIDEO_SIZE[0] // scale, VIDEO_SIZE[1] // scale)
+    columns = max(1, min(columns, len(frames)))
+    rows = math.ceil(len(frames) / columns)
+    sheet = Image.new('RGB', (thumb_size[0] * columns, thumb_size[1] * rows), color=bg_color)
+
+    layouts = {}
+    for i, frame in enumerate(frames):
+        segment_idx, word_idx = timeline[frame]
+        if segment_idx not in layouts:
+            words = [w['text'] for w in segments[segment_idx]['words']]
+            layouts[segment_idx] = layout_segment(words, VIDEO_SIZE, MAX_TEXT_HEIGHT, max_font_size,
+                                                  segment_cache=segment_cache)
+        font_size, positions = layouts[segment_idx][word_idx]
+        pixels = render_timeline_entry(positions, font_size, VIDEO_SIZE,
+                                       bg_color, text_color, lofi_factor=lofi_factor)
+        thumb = Image.fromarray(pixels).reduce(scale) if scale > 1 else Image.fromarray(pixels)
+        sheet.paste(thumb, ((i % columns) * thumb_size[0], (i // columns) * thumb_size[1]))
+
+    buffer = io.BytesIO()
+    sheet.save(buffer, format='PNG', compress_level=1)
+    return buffer.getvalue()
+
+
+def render_with_moviepy(timeline, audio, output_path, size, render_frame, background, fps=24):
+    """
+    Legacy renderer: moviepy pulls frames through make_frame and encodes
+    them with write_videofile. Frames are rendered on demand; only the
+    last one is kept.
+    """
+    state = {'t': None, 'cursor': None, 'entry': None, 'frame': background}
+
+    def make_frame(t):
+        if state['t'] is None or t < state['t']:
+            # moviepy also probes t=0 before writing; restart the cursor
+            state['cursor'] = TimelineCursor(timeline)
+        state['t'] = t
+
+        entry = state['cursor'].visible_at(t)
+        if entry is not state['entry']:
+            state['entry'] = entry
+            state['frame'] = None
+            state['frame'] = background if entry is None else render_frame(
+                entry)
+        return state['frame']
+
+    final_video = VideoClip(make_frame, duration=audio.duration)
     final_video = final_video.set_audio(audio)
-    final_video = final_video.set_duration(audio.duration)
 
     final_video.write_videofile(
-        output_path, fps=24, codec='libx264', audio_codec='aac')
+        output_path, fps=fps, codec='libx264', audio_codec='aac')
+
+
+def generate_video(audio_path, output_path, lyrics_path=None, bg_color_hex="#FFFFFF", max_font_size=400, lofi_factor=1, text_color_hex="#000000", renderer="ffmpeg", workers=1, chunks=1, encoding="standard", layout_cache=None, segment_cache=None):
+    """
+    Renders the lyrics video. With a layout_cache (a DiskCache), the
+    layout plan is looked up by the hash of the lyrics and layout
+    settings, so re-renders in another style skip layout entirely.
+    With a segment_cache (a SegmentLayoutCache), segments laid out by
+    earlier renders of other lyrics or ranges are reused as well.
+    """
+    bg_color = tuple(int(bg_color_hex.lstrip(
+        '#')[i:i+2], 16) for i in (0, 2, 4))
+    text_color = tuple(int(text_color_hex.lstrip(
+        '#')[i:i+2], 16) for i in (0, 2, 4))
+
+    # Load audio early to get duration
+    try:
+        audio = AudioFileClip(audio_path)
+    except Exception as e:
+        print(f"Error loading audio: {e}")
+        return
+
+    raw_lyrics = []
+
+    if lyrics_path:
+        try:
+            with open(lyrics_path, 'r', encoding='utf-8') as f:
+                raw_lyrics = json.load(f)
+        except Exception as e:
+            print(f"Error loading lyrics file: {e}")
+            return
+    else:
+        print("Error: Must provide --lyrics file.")
+        return
+
+    processed_segments = build_segments(raw_lyrics, audio.duration)
+    background = np.array(Image.new('RGB', VIDEO_SIZE, color=bg_color))
+
+    # Chunked encoding runs its own pool, one process per chunk
+    use_chunks = renderer == "ffmpeg" and chunks > 1
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    executor = None
+    if workers > 1 and not use_chunks:
+        executor = process_pool(workers)
+
+    try:
+        plan = None
+        if layout_cache is not None:
+            plan_key = layout_plan_key(raw_lyrics, audio.duration, VIDEO_SIZE, MAX_TEXT_HEIGHT,
+                                       max_font_size=max_font_size)
+            plan = layout_cache.get(plan_key, LAYOUT_PLAN_TTL)
+            if plan is None:
+                # Chunked renders lay out in their own pool otherwise
+                layout_executor = executor
+                if use_chunks:
+                    layout_executor = process_pool(chunks)
+                try:
+                    plan = build_layout_plan(processed_segments, audio.duration, VIDEO_SIZE, MAX_TEXT_HEIGHT,
+                                             max_font_size=max_font_size, executor=layout_executor,
+                                             segment_cache=segment_cache)
+                finally:
+                    if use_chunks:
+                        layout_executor.shutdown()
+                layout_cache.put(plan_key, plan)
+                layout_cache.trim()
+            else:
+                print("Reusing cached layout plan")
+
+        if plan is not None:
+            # Copies, so frames attached by prerender_timeline are not kept
+            timeline = (dict(entry) for entry in plan['entries'])
+        else:
+            timeline = iter_timeline(processed_segments, audio.duration, VIDEO_SIZE, MAX_TEXT_HEIGHT,
+                                     max_font_size=max_font_size, executor=executor,
+                                     segment_cache=segment_cache)
+
+        def render_frame(entry):
+            if 'frame' in entry:
+                return entry['frame']
+            return render_timeline_entry(entry['positions'], entry['font_size'], VIDEO_SIZE,
+                                         bg_color, text_color, lofi_factor=lofi_factor)
+
+        if renderer == "moviepy":
+            # The layout entries are small; keep them so moviepy can seek back
+            render_with_moviepy(list(timeline), audio, output_path,
+                                VIDEO_SIZE, render_frame, background)
+        else:
+            audio_duration = audio.duration
+            audio.close()
+            if use_chunks:
+                render_in_chunks(processed_segments, audio_path, audio_duration, output_path, chunks,
+                                 VIDEO_SIZE, MAX_TEXT_HEIGHT, max_font_size, bg_color, text_color, lofi_factor,
+                                 encoding=encoding, entries=plan and plan['entries'],
+                                 segment_cache=segment_cache)
+            else:
+                if executor is not None:
+                    timeline = prerender_timeline(timeline, executor, 2 * workers, VIDEO_SIZE,
+                                                  bg_color, text_color, lofi_factor)
+                output_params = encoding_params(
+                    encoding, segment_start_times(processed_segments),
+                    frames=frame_count(audio_duration, 24))
+                render_with_ffmpeg(timeline, audio_path, audio_duration, output_path,
+                                   VIDEO_SIZE, render_frame, background, output_params=output_params)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
     print(f"Video saved to {output_path}")
+    print(f"Font cache: {font_cache_stats()}")
 
 
 if __name__ == "__main__":
@@ -350,8 +1436,23 @@ if __name__ == "__main__":
                         help="Maximum font size (starting size)")
     parser.add_argument("--lofi", type=int, default=1,
                         help="Lo-Fi factor (1=None, 5=Standard, 10=Extra)")
+    parser.add_argument("--renderer", choices=["ffmpeg", "moviepy"], default="ffmpeg",
+                        help="ffmpeg pipes frames straight to the encoder, moviepy is the legacy compositor")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processes for layout and rasterization (1=in-process, 0=one per CPU core)")
+    parser.add_argument("--chunks", type=int, default=1,
+                        help="Encode this many segment-aligned chunks in parallel and concat them (ffmpeg renderer only)")
+    parser.add_argument("--encoding", choices=["standard", "static"], default="standard",
+                        help="static drops repeated frames and tunes x264 for still images (ffmpeg renderer only)")
+    parser.add_argument("--layout-cache", default=None,
+                        help="Directory to keep layout plans in, so re-renders in another style skip layout")
+    parser.add_argument("--segment-cache", default=None,
+                        help="SQLite file to share per-segment layouts in between renders and processes")
 
     args = parser.parse_args()
 
     generate_video(args.audio, args.output, lyrics_path=args.lyrics,
-                   bg_color_hex=args.bgcolor, text_color_hex=args.textcolor, max_font_size=args.fontsize, lofi_factor=args.lofi)
+                   bg_color_hex=args.bgcolor, text_color_hex=args.textcolor, max_font_size=args.fontsize, lofi_factor=args.lofi,
+                   renderer=args.renderer, workers=args.workers, chunks=args.chunks, encoding=args.encoding,
+                   layout_cache=DiskCache(args.layout_cache, 200 * 1024 * 1024) if args.layout_cache else None,
+                   segment_cache=SegmentLayoutCache(args.segment_cache, 256 * 1024 * 1024) if args.segment_cache else None)
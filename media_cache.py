@@ -0,0 +1,261 @@
+import hashlib
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+# A download claim not refreshed for this many seconds belongs to a
+# process that died (or was cancelled), and may be taken over
+CLAIM_STALE_SECONDS = 30
+# Seconds between refreshes of a held claim, and between looks at the
+# cache while another process downloads
+CLAIM_REFRESH_SECONDS = 5
+WAIT_POLL_SECONDS = 0.5
+
+
+class MediaCache:
+    """
+    Content-addressed store for downloaded media.
+
+    Files live in `root` named by the SHA-256 of their content; an SQLite
+    index in the same directory maps each source id (e.g. a YouTube video
+    id) to its file, with its size and last access time. Entries are
+    checked against the index on every hit, and the least recently used
+    ones are evicted once the total size exceeds `quota_bytes`. The index
+    and the hit/miss counters are shared by every process using `root`.
+
+    fetch() adds single-flight downloads: while one process downloads a
+    source id, every other caller asking for it waits for that result.
+    """
+
+    def __init__(self, root, quota_bytes):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.index_path = os.path.join(root, "index.db")
+        os.makedirs(root, exist_ok=True)
+
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''CREATE TABLE IF NOT EXISTS media
+                         (source_id TEXT PRIMARY KEY,
+                          digest TEXT NOT NULL,
+                          filename TEXT NOT NULL,
+                          size INTEGER NOT NULL,
+                          last_access REAL NOT NULL)''')
+            conn.execute('''CREATE INDEX IF NOT EXISTS media_last_access
+                         ON media (last_access)''')
+            conn.execute('''CREATE TABLE IF NOT EXISTS media_stats
+                         (name TEXT PRIMARY KEY, value INTEGER NOT NULL)''')
+            conn.executemany("INSERT OR IGNORE INTO media_stats (name, value) VALUES (?, 0)",
+                             [(name,) for name in ("hits", "misses", "evictions", "corrupt",
+                                                   "downloads", "shared")])
+            # Downloads in progress, one row per source id
+            conn.execute('''CREATE TABLE IF NOT EXISTS media_downloads
+                         (source_id TEXT PRIMARY KEY,
+                          owner TEXT NOT NULL,
+                          heartbeat REAL NOT NULL)''')
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.index_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _count(conn, name):
+        conn.execute(
+            "UPDATE media_stats SET value = value + 1 WHERE name = ?", (name,))
+
+    def get(self, source_id, count=True):
+        """
+        Returns the path of the cached file for source_id, or None on a
+        miss. Entries whose file is missing or has the wrong size are
+        dropped and count as misses.
+        """
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute(
+                    "SELECT * FROM media WHERE source_id = ?", (source_id,)).fetchone()
+                if row is not None:
+                    path = os.path.join(self.root, row['filename'])
+                    try:
+                        intact = os.path.getsize(path) == row['size']
+                    except OSError:
+                        intact = False
+
+                    if intact:
+                        conn.execute("UPDATE media SET last_access = ? WHERE source_id = ?",
+                                     (time.time(), source_id))
+                        if count:
+                            self._count(conn, "hits")
+                        return path
+
+                    self._drop(conn, source_id, row['filename'])
+                    self._count(conn, "corrupt")
+                if count:
+                    self._count(conn, "misses")
+                return None
+        finally:
+            conn.close()
+
+    def put(self, source_id, src_path):
+        """
+        Moves src_path into the cache under source_id and returns its new
+        path, evicting least recently used entries to stay within quota.
+        """
+        digest = hashlib.sha256()
+        with open(src_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        digest = digest.hexdigest()
+
+        filename = digest + os.path.splitext(src_path)[1]
+        path = os.path.join(self.root, filename)
+        size = os.path.getsize(src_path)
+        # Same name means same content, so concurrent puts are harmless
+        os.replace(src_path, path)
+
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute('''INSERT OR REPLACE INTO media (source_id, digest, filename, size, last_access)
+                                VALUES (?, ?, ?, ?, ?)''',
+                             (source_id, digest, filename, size, time.time()))
+                self._evict(conn, keep=filename)
+        finally:
+            conn.close()
+        return path
+
+    def fetch(self, source_id, download):
+        """
+        Returns the cached file for source_id, calling download() to fill
+        a miss. download() returns the path of the new file, or None on
+        failure (then fetch returns None too).
+
+        Only one process downloads a given source id at a time; other
+        callers wait for its result, and take over if it fails or dies.
+        """
+        path = self.get(source_id)
+        if path:
+            return path
+
+        owner = f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+        while not self._claim(source_id, owner):
+            time.sleep(WAIT_POLL_SECONDS)
+            path = self.get(source_id, count=False)
+            if path:
+                self._bump("shared")
+                return path
+
+        try:
+            # Another process may have finished between our miss and the claim
+            path = self.get(source_id, count=False)
+            if path:
+                self._bump("shared")
+                return path
+
+            stop = threading.Event()
+            refresher = threading.Thread(
+                target=self._refresh_claim, args=(source_id, owner, stop), daemon=True)
+            refresher.start()
+            try:
+                downloaded = download()
+            finally:
+                stop.set()
+                refresher.join()
+
+            if not downloaded:
+                return None
+            self._bump("downloads")
+            return self.put(source_id, downloaded)
+        finally:
+            self._release(source_id, owner)
+
+    def _claim(self, source_id, owner):
+        """Takes the download claim for source_id unless someone live holds it."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute("DELETE FROM media_downloads WHERE source_id = ? AND heartbeat < ?",
+                             (source_id, now - CLAIM_STALE_SECONDS))
+                cur = conn.execute("INSERT OR IGNORE INTO media_downloads (source_id, owner, heartbeat) VALUES (?, ?, ?)",
+                                   (source_id, owner, now))
+                return cur.rowcount == 1
+        finally:
+            conn.close()
+
+    def _refresh_claim(self, source_id, owner, stop):
+        while not stop.wait(CLAIM_REFRESH_SECONDS):
+            conn = self._connect()
+            try:
+                conn.execute("UPDATE media_downloads SET heartbeat = ? WHERE source_id = ? AND owner = ?",
+                             (time.time(), source_id, owner))
+            finally:
+                conn.close()
+
+    def _release(self, source_id, owner):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM media_downloads WHERE source_id = ? AND owner = ?",
+                         (source_id, owner))
+        finally:
+            conn.close()
+
+    def _bump(self, name):
+        conn = self._connect()
+        try:
+            self._count(conn, name)
+        finally:
+            conn.close()
+
+    def _evict(self, conn, keep=None):
+        """Drops least recently used entries until the cache fits its quota."""
+        total = conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM media").fetchone()[0]
+        if total <= self.quota_bytes:
+            return
+
+        rows = conn.execute(
+            "SELECT source_id, filename, size FROM media ORDER BY last_access").fetchall()
+        for row in rows:
+            if total <= self.quota_bytes:
+                break
+            if row['filename'] == keep:
+                continue
+            self._drop(conn, row['source_id'], row['filename'])
+            total -= row['size']
+            self._count(conn, "evictions")
+
+    def _drop(self, conn, source_id, filename):
+        """Removes an entry, and its file unless another entry shares it."""
+        conn.execute("DELETE FROM media WHERE source_id = ?", (source_id,))
+        shared = conn.execute("SELECT 1 FROM media WHERE filename = ? LIMIT 1",
+                              (filename,)).fetchone()
+        if shared is None:
+            try:
+                os.remove(os.path.join(self.root, filename))
+            except OSError:
+                pass
+
+    def stats(self):
+        """Returns hit/miss/eviction counters and the cache's size."""
+        conn = self._connect()
+        try:
+            stats = {row['name']: row['value']
+                     for row in conn.execute("SELECT name, value FROM media_stats")}
+            entries, size = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM media").fetchone()
+        finally:
+            conn.close()
+        stats["entries"] = entries
+        stats["bytes"] = size
+        stats["quota_bytes"] = self.quota_bytes
+        return stats
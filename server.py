@@ -2,7 +2,7 @@ from lyrics_fetcher import search_lyrics, get_lyrics_by_id, parse_lrc
 from main import generate_video
 from audio_fetcher import trim_audio, cleanup_file, search_videos, download_audio_by_url
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi.responses import FileResponse, HTMLResponse, Response
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 import uvicorn
@@ -11,8 +11,16 @@ import shutil
 import sqlite3
 import datetime
 import asyncio
+import functools
+import glob
+import hashlib
+import json
+import multiprocessing
+import socket
+import time
 import uuid
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Union
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 
 import sys
@@ -21,68 +29,302 @@ import sys
 from generate_lyrics import get_lyrics, parse_time
 
 from lyrics_fetcher import search_lyrics, get_lyrics_by_id, parse_lrc
-from audio_fetcher import first_audio, trim_audio, cleanup_file, search_videos, download_audio_by_url
-from main import generate_video
+from audio_fetcher import first_audio, trim_audio, trim_audio_ranges, cleanup_file, search_videos, download_audio_by_url
+from main import generate_video, render_preview
+from media_cache import MediaCache
+from disk_cache import DiskCache
+from layout_cache import SegmentLayoutCache
+import job_queue
 
 # --- Job Queue Structures ---
 
 
 class Job(BaseModel):
     id: str
-    status: str  # 'queued', 'processing', 'completed', 'failed'
+    status: str  # 'queued', 'processing', 'completed', 'failed', 'cancelled'
+    # While processing: 'fetching', 'waiting_render' or 'rendering'; a
+    # clip whose batch is still being fetched is 'waiting_fetch'
+    stage: Optional[str] = None
     position: int = 0
     result: Optional[str] = None
     error: Optional[str] = None
     created_at: float
-    request_payload: Optional['GenerateRequest'] = None
+    request_payload: Optional[Union['GenerateRequest', 'BatchRequest']] = None
+    # The batch a clip job belongs to, and the clip jobs of a batch
+    parent_id: Optional[str] = None
+    clips: Optional[List['Job']] = None
+
+
+# Jobs live in the 'jobs' table of DB_NAME (see job_queue.py), so any
+# number of API and worker processes can share them and a restart loses
+# nothing.
+
+# Each job is fetched (lyrics, audio search, download, trim) by one of
+# IO_WORKERS, then rendered by one of RENDER_WORKERS, so slow downloads
+# never hold a render slot. Every stage runs in its own process.
+# 0 and 0 make an API-only process; run `python server.py --worker` elsewhere.
+IO_WORKERS = int(os.environ.get("IO_WORKERS", 4))
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", os.cpu_count() or 1))
+
+# Seconds between looks at the queue when it is empty
+POLL_INTERVAL = 1.0
+# Seconds between lease renewals (and cancellation checks) of a running job
+HEARTBEAT_INTERVAL = 5.0
+# Seconds between purges of finished jobs, which delete those finished more
+# than JOB_TTL_SECONDS ago and all but the newest JOB_HISTORY_LIMIT
+PURGE_INTERVAL = 60.0
+JOB_TTL_SECONDS = int(os.environ.get("JOB_TTL_SECONDS", job_queue.JOB_TTL_SECONDS))
+JOB_HISTORY_LIMIT = int(os.environ.get("JOB_HISTORY_LIMIT", job_queue.JOB_HISTORY_LIMIT))
+
+# Blocking network calls made by request handlers (yt-dlp, LRCLIB) run on
+# this bounded pool, so a slow search ties up neither the event loop nor
+# the pool that job status reads use. Calls that take longer than
+# SEARCH_TIMEOUT seconds answer 504.
+SEARCH_THREADS = int(os.environ.get("SEARCH_THREADS", 8))
+SEARCH_TIMEOUT = 20.0
+search_executor = ThreadPoolExecutor(
+    max_workers=SEARCH_THREADS, thread_name_prefix="search")
+
+# SQLite reads and writes made by request handlers (job status, queue
+# positions, history) run on their own pool...
+DB_THREADS = int(os.environ.get("DB_THREADS", 8))
+db_executor = ThreadPoolExecutor(
+    max_workers=DB_THREADS, thread_name_prefix="db")
+# ...and the blocking calls of this process's stage workers on another,
+# one thread per worker: a busy worker spends its whole stage waiting
+# on its stage process, and must not hold a thread a handler needs
+worker_executor = ThreadPoolExecutor(
+    max_workers=max(1, IO_WORKERS + RENDER_WORKERS), thread_name_prefix="worker")
+
+# Part of every render fingerprint; bump it when main.py starts drawing
+# different videos from the same inputs, so older outputs are not reused
+RENDER_VERSION = 1
+
+# Stage processes of running jobs, so they can be cancelled
+running_jobs: Dict[str, multiprocessing.Process] = {}
+
+# Spawn rather than fork: the parent is running an event loop and threads
+mp_context = multiprocessing.get_context("spawn")
 
+# --- Background Worker ---
 
-job_queue: asyncio.Queue = asyncio.Queue()
-job_store: Dict[str, Job] = {}
 
-# --- Background Worker ---
+class JobCancelled(Exception):
+    pass
+
+
+def job_stage(row):
+    """Stage label reported by /status for a jobs table row."""
+    if row['status'] != "processing":
+        return None
+    if row['stage'] == "fetch":
+        return "fetching"
+    if row['stage'] == job_queue.BATCH_STAGE:
+        # A batch waits on its clips, a clip on its batch's fetch
+        return "waiting_fetch" if row['parent_id'] else "rendering"
+    return "rendering" if row['lease_owner'] else "waiting_render"
+
+
+def job_from_row(row):
+    """Builds the API's Job model from a jobs table row."""
+    payload = json.loads(row['payload'])
+    request = BatchRequest if "clips" in payload else GenerateRequest
+    return Job(id=row['id'], status=row['status'], stage=job_stage(row),
+               result=row['result'], error=row['error'], created_at=row['created_at'],
+               request_payload=request.model_validate(payload), parent_id=row['parent_id'])
+
+
+def run_stage(stage, req, base_name, conn, job_id=None, owner=None):
+    """
+    Entry point of a stage process. Sends ("ok", result) or
+    ("error", message) back over conn: the updated request as JSON after
+    'fetch', the video URL after 'render'. A fetch that finds its video
+    already rendered sends ("done", url) instead, and one that finds it
+    being rendered by another job sends ("follow", None). The fetch of a
+    batch sends ("batch", outcomes) for job_queue.release_batch.
+    """
+    try:
+        if stage == "fetch" and isinstance(req, BatchRequest):
+            clips = job_queue.get_clips(DB_NAME, job_id)
+            conn.send(("batch", fetch_batch_inputs(req, base_name, clips)))
+            return
+        if stage == "fetch":
+            fingerprint = fetch_job_lyrics(req, base_name)
+            url = find_render(fingerprint)
+            if url:
+                print(f"Reusing render {url}")
+                conn.send(("done", url))
+                return
+            if job_id and not job_queue.lead_render(DB_NAME, job_id, owner, fingerprint):
+                conn.send(("follow", None))
+                return
+            fetch_job_audio(req, base_name)
+            result = req.model_dump_json()
+        else:
+            result = render_job_output(req, base_name)
+        conn.send(("ok", result))
+    except Exception as e:
+        conn.send(("error", str(e)))
+    finally:
+        conn.close()
 
 
-async def worker():
-    print("Worker started, waiting for jobs...")
-    while True:
-        job_id = await job_queue.get()
-        job = job_store.get(job_id)
+def job_base_name(job: Job):
+    """Unique file stem for a job's temp files and output video."""
+    req = job.request_payload
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    safe_song = "".join([c for c in req.song if c.isalnum()
+                        or c in (' ', '-', '_')]).strip()
+    return f"{safe_song}_{timestamp}_{job.id[:8]}"
 
-        if not job:
-            job_queue.task_done()
-            continue
 
-        try:
-            print(f"Processing job {job_id}")
-            job.status = "processing"
+def remove_job_files(base_name):
+    """Deletes the temp files and any partial output of a job."""
+    for path in glob.glob(os.path.join(TEMP_DIR, glob.escape(base_name) + ".*")):
+        cleanup_file(path)
+    output_video = os.path.join(OUTPUT_DIR, f"{base_name}.mp4")
+    cleanup_file(output_video)
+    cleanup_file(output_video + ".chunks.txt")
+
+
+async def run_in_process(job: Job, base_name, owner, stage):
+    """
+    Runs one stage of the job in a fresh process and waits for it
+    without blocking the event loop, renewing the job's lease meanwhile.
+    Returns the stage's (status, result); raises JobCancelled if the job was
+    cancelled (or its lease lost) and Exception on failure.
+    """
+    if not await run_on(worker_executor, job_queue.renew_lease, DB_NAME, job.id, owner, base_name):
+        raise JobCancelled()
+
+    parent_conn, child_conn = mp_context.Pipe(duplex=False)
+    process = mp_context.Process(
+        target=run_stage, args=(stage, job.request_payload, base_name, child_conn, job.id, owner),
+        daemon=True)
+    process.start()
+    child_conn.close()
+    running_jobs[job.id] = process
 
-            # Extract request data attached to the job object (we'll attach it dynamically)
-            req = getattr(job, "request_payload", None)
+    try:
+        # poll turns true once the child reports back, or once it has
+        # exited without doing so (recv then raises EOFError)
+        while not await run_on(worker_executor, parent_conn.poll, HEARTBEAT_INTERVAL):
+            if not await run_on(worker_executor, job_queue.renew_lease, DB_NAME, job.id, owner):
+                process.terminate()
+                raise JobCancelled()
+        try:
+            status, value = parent_conn.recv()
+        except EOFError:
+            status, value = "error", None
+        await run_on(worker_executor, process.join)
+    finally:
+        running_jobs.pop(job.id, None)
+        parent_conn.close()
+
+    if status == "error":
+        raise Exception(value or f"{stage.capitalize()} process exited with code {process.exitcode}")
+    return status, value
+
+
+async def worker(stage, worker_id=0):
+    owner = f"{socket.gethostname()}:{os.getpid()}:{stage}{worker_id}"
+    print(f"Worker {owner} started, waiting for jobs...")
+    last_purge = 0.0
+    while True:
+        row = await run_on(worker_executor, job_queue.claim_job, DB_NAME, owner, stage)
+        if row is None:
+            if stage == "fetch" and worker_id == 0 and time.monotonic() - last_purge > PURGE_INTERVAL:
+                last_purge = time.monotonic()
+                await run_on(worker_executor, job_queue.purge_finished, DB_NAME,
+                             JOB_TTL_SECONDS, JOB_HISTORY_LIMIT)
+            await asyncio.sleep(POLL_INTERVAL)
+            continue
 
-            if req:
-                # Run the synchronous generation in a separate thread
-                video_url = await asyncio.to_thread(process_video_generation, req)
-                job.result = video_url
-                job.status = "completed"
-            else:
-                job.status = "failed"
-                job.error = "No payload found"
+        job_id = row['id']
+        if stage == "fetch" and row['base_name']:
+            # Leftovers of an attempt whose worker was lost
+            remove_job_files(row['base_name'])
 
+        base_name = None
+        status, outcome, result, error = "failed", None, None, None
+        try:
+            print(f"Worker {owner} processing job {job_id}")
+            job = job_from_row(row)
+
+            # The render stage works on the files the fetch stage left
+            base_name = row['base_name'] if stage == "render" else job_base_name(job)
+            # Separate process, so one stuck job cannot block the rest
+            outcome, result = await run_in_process(job, base_name, owner, stage)
+            status = "completed"
+        except JobCancelled:
+            status = "cancelled"
         except Exception as e:
             print(f"Job {job_id} failed: {e}")
-            job.status = "failed"
-            job.error = str(e)
-        finally:
-            job_queue.task_done()
+            error = str(e)
+
+        if status == "cancelled":
+            done = False
+        elif outcome == "follow":
+            # lead_render handed the job over to the one rendering its video
+            done = False
+        elif outcome == "ok" and stage == "fetch":
+            done = await run_on(
+                worker_executor, job_queue.advance_job, DB_NAME, job_id, owner, "render", result)
+        elif outcome == "batch":
+            # The clips go on to the render stage as jobs of their own
+            followers = await run_on(
+                worker_executor, job_queue.release_batch, DB_NAME, job_id, owner, result)
+            done = followers is not None
+            for clip in result:
+                if done and clip['id'] in followers:
+                    remove_job_files(clip['base_name'])
+        else:
+            done = await run_on(
+                worker_executor, job_queue.finish_job, DB_NAME, job_id, owner, status, result, error)
+        if base_name and (not done or outcome not in ("ok", "batch")):
+            remove_job_files(base_name)
+
+
+def start_workers():
+    """Starts this process's fetch and render workers as tasks."""
+    return ([asyncio.create_task(worker("fetch", i)) for i in range(IO_WORKERS)] +
+            [asyncio.create_task(worker("render", i)) for i in range(RENDER_WORKERS)])
+
+
+async def run_blocking_io(func, *args, timeout=SEARCH_TIMEOUT):
+    """
+    Runs func(*args) on the search pool and returns its result.
+    Raises a 504 if it takes longer than timeout; the call itself runs
+    on to completion in the background.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(search_executor, functools.partial(func, *args))
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Upstream search timed out")
+
+
+async def run_on(executor, func, *args):
+    """Runs func(*args) on executor without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args))
+
+
+async def run_workers():
+    await asyncio.gather(*start_workers())
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Start worker on startup
-    asyncio.create_task(worker())
+    # Start the worker pools on startup
+    workers = start_workers()
     yield
-    # Clean up if needed
+    for task in workers:
+        task.cancel()
+    # Their jobs are picked up again once the leases expire
+    for process in list(running_jobs.values()):
+        process.terminate()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -101,9 +343,24 @@ if not os.path.exists("static"):
 if not os.path.exists(MEDIA_DIR):
     os.makedirs(MEDIA_DIR)
 
+# Downloaded audio, shared by all jobs and processes (see media_cache.py)
+MEDIA_CACHE_QUOTA_MB = int(os.environ.get("MEDIA_CACHE_QUOTA_MB", 2048))
+media_cache = MediaCache(MEDIA_DIR, MEDIA_CACHE_QUOTA_MB * 1024 * 1024)
+
 if not os.path.exists(TEMP_DIR):
     os.makedirs(TEMP_DIR)
 
+# Layout plans by lyrics hash, so re-renders in a new style skip layout
+LAYOUT_CACHE_DIR = os.environ.get("LAYOUT_CACHE_DIR", os.path.join("cache", "layouts"))
+LAYOUT_CACHE_MAX_BYTES = 200 * 1024 * 1024
+layout_cache = DiskCache(LAYOUT_CACHE_DIR, LAYOUT_CACHE_MAX_BYTES)
+
+# Per-segment layouts shared by every render process, so segments that
+# show up in other ranges or requests of a song are not laid out again
+SEGMENT_CACHE_PATH = os.environ.get("SEGMENT_CACHE_PATH", os.path.join("cache", "segments.db"))
+SEGMENT_CACHE_QUOTA_MB = int(os.environ.get("SEGMENT_CACHE_QUOTA_MB", 256))
+segment_cache = SegmentLayoutCache(SEGMENT_CACHE_PATH, SEGMENT_CACHE_QUOTA_MB * 1024 * 1024)
+
 # Initialize DB
 
 
@@ -116,12 +373,20 @@ def init_db():
                   artist TEXT,
                   audio TEXT,
                   filename TEXT, 
-                  created_at TIMESTAMP)''')
+                  created_at TIMESTAMP,
+                  fingerprint TEXT)''')
+    columns = [row[1] for row in c.execute("PRAGMA table_info(history)")]
+    if 'fingerprint' not in columns:
+        c.execute("ALTER TABLE history ADD COLUMN fingerprint TEXT")
+    c.execute('''CREATE INDEX IF NOT EXISTS history_fingerprint
+                 ON history (fingerprint) WHERE fingerprint IS NOT NULL''')
     conn.commit()
     conn.close()
+    job_queue.init_jobs(DB_NAME)
 
 
 init_db()
+queue_positions = job_queue.QueuePositions(DB_NAME)
 
 # Mount generated files
 # Mount generated files
@@ -149,6 +414,41 @@ class GenerateRequest(BaseModel):
     textcolor: str = "#000000"
 
 
+class ClipRequest(BaseModel):
+    start_time: str
+    end_time: str
+    # Style of this clip; unset fields take the batch's
+    lofi: Optional[int] = None
+    fontsize: Optional[int] = None
+    bgcolor: Optional[str] = None
+    textcolor: Optional[str] = None
+
+
+class BatchRequest(BaseModel):
+    song: str
+    artist: str
+    clips: List[ClipRequest]
+    lofi: int = 1
+    fontsize: int = 400
+    bgcolor: str = "#FFFFFF"
+    textcolor: str = "#000000"
+    video_id: Optional[str] = None
+    lyrics_id: Optional[int] = None
+    manual_lrc: Optional[str] = None
+
+
+# Most clips one /generate/batch request may ask for
+MAX_BATCH_CLIPS = 20
+
+
+class PreviewRequest(GenerateRequest):
+    # Timeline frames to draw, one per word in order; default: the end of
+    # every line
+    frames: Optional[List[int]] = None
+    width: int = 270  # of each frame in the contact sheet
+    columns: int = 4
+
+
 @app.get("/")
 async def read_index():
     index_path = get_resource_path("static/index.html")
@@ -165,8 +465,7 @@ async def read_history_page():
     return HTMLResponse("<h1>History page not found. Please create static/history.html</h1>")
 
 
-@app.get("/history")
-async def get_history():
+def read_history():
     conn = sqlite3.connect(DB_NAME)
     conn.row_factory = sqlite3.Row
     c = conn.cursor()
@@ -176,104 +475,207 @@ async def get_history():
     return [dict(row) for row in rows]
 
 
+@app.get("/history")
+async def get_history():
+    return await run_on(db_executor, read_history)
+
+
 @app.get("/search/video")
 async def search_video_endpoint(q: str):
-    results = search_videos(q)
+    results = await run_blocking_io(search_videos, q)
     return results
 
 
 @app.get("/search/lyrics")
 async def search_lyrics_endpoint(q: str):
-    results = search_lyrics(q)
+    results = await run_blocking_io(search_lyrics, q)
     return results
 
 
+@app.get("/media/stats")
+async def get_media_stats():
+    return await run_on(db_executor, media_cache.stats)
+
+
+@app.get("/layout/stats")
+async def get_layout_stats():
+    return await run_on(db_executor, segment_cache.stats)
+
+
 @app.get("/status/{job_id}")
 async def get_job_status(job_id: str):
-    job = job_store.get(job_id)
-    if not job:
+    row = await run_on(db_executor, job_queue.get_job, DB_NAME, job_id)
+    if not row:
         raise HTTPException(status_code=404, detail="Job not found")
+    job = job_from_row(row)
+    if isinstance(job.request_payload, BatchRequest):
+        clips = await run_on(db_executor, job_queue.get_clips, DB_NAME, job_id)
+        job.clips = [job_from_row(clip) for clip in clips]
 
     # Calculate queue position if queued
     if job.status == "queued":
-        # This is O(N) but queue likely short.
-        # For production execution, better data structures exist, but this is fine for local.
-        # We assume queue order matches creation time for simplicity.
-        # Actually simplest way: iterate the internal deque if accessible, or just count 'queued' jobs created before this one.
-        # Let's just estimate based on job_store creation times of other queued jobs
-        queued_jobs = [j for j in job_store.values(
-        ) if j.status == 'queued' and j.created_at < job.created_at]
-        job.position = len(queued_jobs) + 1
+        job.position = await run_on(db_executor, queue_positions.position, job_id)
     else:
         job.position = 0
 
     return job
 
 
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    previous = await run_on(db_executor, job_queue.cancel_job, DB_NAME, job_id)
+    if previous is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    if previous not in job_queue.ACTIVE_STATUSES:
+        raise HTTPException(
+            status_code=409, detail=f"Job already {previous}")
+
+    # Queued jobs are never claimed now. A running job's worker notices at
+    # its next heartbeat, stops the stage and removes its files; if it
+    # runs in this process, stop it right away. Cancelling a batch
+    # cancels its clips as well
+    clips = await run_on(db_executor, job_queue.get_clips, DB_NAME, job_id)
+    for running_id in [job_id] + [clip['id'] for clip in clips]:
+        process = running_jobs.get(running_id)
+        if process is not None:
+            process.terminate()
+
+    return {"job_id": job_id, "status": "cancelled"}
+
+
 @app.post("/generate")
 async def queue_generate_request(req: GenerateRequest):
     job_id = str(uuid.uuid4())
-    import time
-    job = Job(id=job_id, status="queued",
-              created_at=time.time(), request_payload=req)
+    await run_on(db_executor, job_queue.enqueue_job, DB_NAME, job_id, req.model_dump_json())
 
-    # Attach payload dynamically to avoid polluting BaseModel if valid (or just use a wrapper)
-    # Python allows arbitrary attributes on objects but Pydantic might restrict it depending on config.
-    # Let's just store the payload in a parallel dict or just use a helper method.
-    # Let's attach to the job instance.
-    # setattr(job, "request_payload", req) # Now handled in constructor
+    return {"job_id": job_id, "status": "queued"}
 
-    job_store[job_id] = job
-    await job_queue.put(job_id)
 
-    return {"job_id": job_id, "status": "queued"}
+def clip_request(batch: BatchRequest, clip: ClipRequest):
+    """The request of a single clip of a batch."""
+    style = {field: getattr(batch, field) if getattr(clip, field) is None else getattr(clip, field)
+             for field in ("lofi", "fontsize", "bgcolor", "textcolor")}
+    return GenerateRequest(song=batch.song, artist=batch.artist,
+                           start_time=clip.start_time, end_time=clip.end_time,
+                           video_id=batch.video_id, lyrics_id=batch.lyrics_id,
+                           manual_lrc=batch.manual_lrc, **style)
 
 
-def process_video_generation(req: GenerateRequest):
-    print(f"Starting generation for {req.song}")
+@app.post("/generate/batch")
+async def queue_batch_request(req: BatchRequest):
+    if not 1 <= len(req.clips) <= MAX_BATCH_CLIPS:
+        raise HTTPException(
+            status_code=400, detail=f"A batch takes 1 to {MAX_BATCH_CLIPS} clips")
 
-    # 1. Setup paths with unique timestamp
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    safe_song = "".join([c for c in req.song if c.isalnum()
-                        or c in (' ', '-', '_')]).strip()
-    base_name = f"{safe_song}_{timestamp}"
+    # One job fetches lyrics and audio for every clip, then each clip
+    # renders as a job of its own
+    job_id = str(uuid.uuid4())
+    clips = [(str(uuid.uuid4()), clip_request(req, clip).model_dump_json())
+             for clip in req.clips]
+    await run_on(db_executor, job_queue.enqueue_batch, DB_NAME, job_id, req.model_dump_json(), clips)
 
-    output_json = os.path.join(TEMP_DIR, f"{base_name}.json")
-    output_audio = os.path.join(TEMP_DIR, f"{base_name}.mp3")
-    output_video = os.path.join(OUTPUT_DIR, f"{base_name}.mp4")
+    return {"job_id": job_id, "status": "queued", "clip_ids": [clip_id for clip_id, _ in clips]}
 
-    # 2. Process Lyrics
+
+def build_preview(req: PreviewRequest):
+    """PNG contact sheet of the request's frames, drawn in this process."""
+    return render_preview(load_sliced_lyrics(req), frames=req.frames,
+                          bg_color_hex=req.bgcolor, text_color_hex=req.textcolor,
+                          max_font_size=req.fontsize, lofi_factor=req.lofi,
+                          width=req.width, columns=req.columns, segment_cache=segment_cache)
+
+
+@app.post("/preview")
+async def preview_request(req: PreviewRequest):
+    # Bypasses the job queue: lyrics come from the LRCLIB cache, layouts
+    # from the segment cache, and only the chosen frames are drawn
     try:
-        start_seconds = parse_time(req.start_time)
-        end_seconds = parse_time(req.end_time)
-
-        full_lyrics = None
-        if req.manual_lrc:
-            print("Using Manual LRC content")
-            full_lyrics = parse_lrc(req.manual_lrc)
-        elif req.lyrics_id:
-            print(f"Fetching lyrics by ID: {req.lyrics_id}")
-            full_lyrics = get_lyrics_by_id(req.lyrics_id)
-        else:
-            print(f"Fetching lyrics by search: {req.artist} - {req.song}")
-            full_lyrics = get_lyrics(req.artist, req.song)
+        png = await run_blocking_io(build_preview, req)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return Response(content=png, media_type="image/png")
 
-        if not full_lyrics:
-            raise Exception("Lyrics not found")
 
-        sliced_lyrics = []
-        for line in full_lyrics:
-            t = line['start']
-            if t >= start_seconds and t <= end_seconds:
-                sliced_lyrics.append({
-                    "start": round(line['start'] - start_seconds, 2),
-                    "text": line['text']
-                })
+def job_paths(base_name):
+    """Sliced lyrics, trimmed audio and output video paths of a job."""
+    return (os.path.join(TEMP_DIR, f"{base_name}.json"),
+            # AAC, so the video mux can copy it without re-encoding
+            os.path.join(TEMP_DIR, f"{base_name}.m4a"),
+            os.path.join(OUTPUT_DIR, f"{base_name}.mp4"))
 
-        if not sliced_lyrics:
-            raise Exception("No lyrics in time range")
 
-        import json
+def process_video_generation(req: GenerateRequest, base_name=None):
+    # 1. Setup paths with unique timestamp
+    if base_name is None:
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        safe_song = "".join([c for c in req.song if c.isalnum()
+                            or c in (' ', '-', '_')]).strip()
+        base_name = f"{safe_song}_{timestamp}"
+
+    fetch_job_inputs(req, base_name)
+    return render_job_output(req, base_name)
+
+
+def render_fingerprint(req: GenerateRequest, sliced_lyrics):
+    """
+    Hash of everything that decides what a job's video looks and sounds
+    like: the sliced lyrics, the audio source and range, and the style.
+    Jobs with equal fingerprints produce the same video.
+    """
+    key = {
+        "version": RENDER_VERSION,
+        "lyrics": sliced_lyrics,
+        "audio": req.video_id,
+        "start": parse_time(req.start_time),
+        "end": parse_time(req.end_time),
+        "lofi": req.lofi,
+        "fontsize": req.fontsize,
+        "bgcolor": req.bgcolor.lstrip('#').lower(),
+        "textcolor": req.textcolor.lstrip('#').lower(),
+    }
+    encoded = json.dumps(key, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def find_render(fingerprint):
+    """URL of an existing video with this render fingerprint, or None."""
+    conn = sqlite3.connect(DB_NAME)
+    try:
+        rows = conn.execute("SELECT filename FROM history WHERE fingerprint = ? ORDER BY id DESC",
+                            (fingerprint,)).fetchall()
+    finally:
+        conn.close()
+    for (filename,) in rows:
+        if os.path.exists(os.path.join(OUTPUT_DIR, filename)):
+            return f"/generated/{filename}"
+    return None
+
+
+def fetch_job_inputs(req: GenerateRequest, base_name):
+    """
+    I/O stage: slices the lyrics and fetches and trims the audio into the
+    job's temp files. Fills in req.video_id if it was searched for.
+    """
+    fetch_job_lyrics(req, base_name)
+    fetch_job_audio(req, base_name)
+
+
+def fetch_job_lyrics(req: GenerateRequest, base_name):
+    """
+    First half of the I/O stage: writes the sliced lyrics to the job's
+    temp files and picks the audio source, filling in req.video_id if it
+    was searched for. Returns the job's render fingerprint.
+    """
+    print(f"Starting generation for {req.song}")
+    output_json, _, _ = job_paths(base_name)
+
+    # 2. Process Lyrics
+    try:
+        sliced_lyrics = load_sliced_lyrics(req)
+
         with open(output_json, 'w', encoding='utf-8') as f:
             json.dump(sliced_lyrics, f)
 
@@ -281,34 +683,83 @@ def process_video_generation(req: GenerateRequest):
         print(f"Lyrics Error: {e}")
         raise e
 
+    if not req.video_id:
+        query = f"{req.artist} - {req.song} audio"
+        req.video_id = first_audio(query)
+        if not req.video_id:
+            raise Exception("Audio not found")
+
+    return render_fingerprint(req, sliced_lyrics)
+
+
+def load_sliced_lyrics(req: GenerateRequest):
+    """
+    Fetches the request's lyrics and returns the lines between its start
+    and end time, with times relative to the start.
+    """
+    return slice_lyrics(load_lyrics(req), req)
+
+
+def load_lyrics(req):
+    """Fetches the full lyrics of a request (or batch) from its source."""
+    full_lyrics = None
+    if req.manual_lrc:
+        print("Using Manual LRC content")
+        full_lyrics = parse_lrc(req.manual_lrc)
+    elif req.lyrics_id:
+        print(f"Fetching lyrics by ID: {req.lyrics_id}")
+        full_lyrics = get_lyrics_by_id(req.lyrics_id)
+    else:
+        print(f"Fetching lyrics by search: {req.artist} - {req.song}")
+        full_lyrics = get_lyrics(req.artist, req.song)
+
+    if not full_lyrics:
+        raise Exception("Lyrics not found")
+    return full_lyrics
+
+
+def slice_lyrics(full_lyrics, req: GenerateRequest):
+    """Lines of full_lyrics in the request's range, timed from its start."""
+    start_seconds = parse_time(req.start_time)
+    end_seconds = parse_time(req.end_time)
+
+    sliced_lyrics = []
+    for line in full_lyrics:
+        t = line['start']
+        if t >= start_seconds and t <= end_seconds:
+            sliced_lyrics.append({
+                "start": round(line['start'] - start_seconds, 2),
+                "text": line['text']
+            })
+
+    if not sliced_lyrics:
+        raise Exception("No lyrics in time range")
+
+    return sliced_lyrics
+
+
+def fetch_job_audio(req: GenerateRequest, base_name):
+    """
+    Second half of the I/O stage: fetches the audio picked by
+    fetch_job_lyrics and trims it into the job's temp files.
+    """
+    _, output_audio, _ = job_paths(base_name)
+    start_seconds = parse_time(req.start_time)
+    end_seconds = parse_time(req.end_time)
+
     # 3. Process Audio
     try:
         temp_audio = None
 
-        if not req.video_id:
-            query = f"{req.artist} - {req.song} audio"
-            req.video_id = first_audio(query)
-
-        exists = False
-        try:
-            conn = sqlite3.connect(DB_NAME)
-            c = conn.cursor()
-            c.execute(
-                "SELECT EXISTS(SELECT 1 FROM history WHERE audio = ?)", (req.video_id,))
-            exists = bool(c.fetchone()[0])
-            conn.close()
-        except Exception as e:
-            print(f"DB Error: {e}")
-            raise e
-
-        temp_audio_path = os.path.join(MEDIA_DIR, req.video_id)  # type: ignore
-        if not exists:
+        def download():
+            # Download next to the job's other temp files; the cache moves
+            # it into MEDIA_DIR once complete
             video_url = f"https://www.youtube.com/watch?v={req.video_id}"
-            temp_audio = download_audio_by_url(
-                video_url, temp_filename=temp_audio_path)
-        else:
-            temp_audio = f"{temp_audio_path}.mp3"
+            return download_audio_by_url(
+                video_url, temp_filename=os.path.join(TEMP_DIR, f"{base_name}.download"))
 
+        # Jobs asking for the same video at once share one download
+        temp_audio = media_cache.fetch(req.video_id, download)
         if not temp_audio:
             raise Exception("Audio download failed")
 
@@ -322,6 +773,87 @@ def process_video_generation(req: GenerateRequest):
         print(f"Audio Error: {e}")
         raise e
 
+
+def fetch_batch_inputs(batch: BatchRequest, base_name, clips):
+    """
+    I/O stage of a batch: fetches the lyrics and the audio once for all
+    of its clip jobs, writes each clip's sliced lyrics to its temp files
+    and cuts every clip's audio in one decode. Clips already rendered by
+    earlier jobs, or with nothing to render, are settled here, and clips
+    repeating an earlier one follow it. Returns
+    one outcome per clip for job_queue.release_batch.
+    """
+    print(f"Starting batch of {len(clips)} clips for {batch.song}")
+    full_lyrics = load_lyrics(batch)
+
+    if not batch.video_id:
+        query = f"{batch.artist} - {batch.song} audio"
+        batch.video_id = first_audio(query)
+        if not batch.video_id:
+            raise Exception("Audio not found")
+
+    outcomes, ranges = [], []
+    for i, clip in enumerate(clips):
+        req = GenerateRequest.model_validate_json(clip['payload'])
+        req.video_id = batch.video_id
+        clip_base_name = f"{base_name}.clip{i}"
+        outcome = {"id": clip['id'], "base_name": clip_base_name,
+                   "payload": req.model_dump_json()}
+        outcomes.append(outcome)
+
+        try:
+            sliced_lyrics = slice_lyrics(full_lyrics, req)
+        except Exception as e:
+            outcome.update(status="failed", error=str(e))
+            continue
+
+        outcome["fingerprint"] = render_fingerprint(req, sliced_lyrics)
+        url = find_render(outcome["fingerprint"])
+        if url:
+            print(f"Reusing render {url}")
+            outcome.update(status="completed", result=url)
+            continue
+
+        if any(other.get("status") == "render" and other["fingerprint"] == outcome["fingerprint"]
+               for other in outcomes[:-1]):
+            # Same video as an earlier clip; finish_job completes it too
+            outcome["status"] = "follow"
+            continue
+
+        output_json, output_audio, _ = job_paths(clip_base_name)
+        with open(output_json, 'w', encoding='utf-8') as f:
+            json.dump(sliced_lyrics, f)
+        ranges.append((parse_time(req.start_time), parse_time(req.end_time), output_audio))
+        outcome["status"] = "render"
+
+    to_render = [outcome for outcome in outcomes if outcome["status"] == "render"]
+    if to_render:
+        def download():
+            video_url = f"https://www.youtube.com/watch?v={batch.video_id}"
+            return download_audio_by_url(
+                video_url, temp_filename=os.path.join(TEMP_DIR, f"{base_name}.download"))
+
+        temp_audio = media_cache.fetch(batch.video_id, download)
+        if not temp_audio:
+            raise Exception("Audio download failed")
+
+        for outcome, trimmed in zip(to_render, trim_audio_ranges(temp_audio, ranges)):
+            if not trimmed:
+                remove_job_files(outcome["base_name"])
+                outcome.update(status="failed", error="Audio trim failed")
+
+    return outcomes
+
+
+def render_job_output(req: GenerateRequest, base_name):
+    """
+    CPU stage: renders the files left by fetch_job_inputs into the output
+    video, logs it to the history and returns its URL.
+    """
+    output_json, output_audio, output_video = job_paths(base_name)
+    with open(output_json, 'r', encoding='utf-8') as f:
+        fingerprint = render_fingerprint(req, json.load(f))
+
     # 4. Generate Video
     try:
         generate_video(
@@ -332,6 +864,8 @@ def process_video_generation(req: GenerateRequest):
             text_color_hex=req.textcolor,
             max_font_size=req.fontsize,
             lofi_factor=req.lofi,
+            layout_cache=layout_cache,
+            segment_cache=segment_cache,
         )
     except Exception as e:
         print(f"Video Gen Error: {e}")
@@ -341,8 +875,8 @@ def process_video_generation(req: GenerateRequest):
     try:
         conn = sqlite3.connect(DB_NAME)
         c = conn.cursor()
-        c.execute("INSERT INTO history (song, artist, audio, filename, created_at) VALUES (?, ?, ?, ?, ?)",
-                  (req.song, req.artist, req.video_id, f"{base_name}.mp4", datetime.datetime.now()))
+        c.execute("INSERT INTO history (song, artist, audio, filename, created_at, fingerprint) VALUES (?, ?, ?, ?, ?, ?)",
+                  (req.song, req.artist, req.video_id, f"{base_name}.mp4", datetime.datetime.now(), fingerprint))
         conn.commit()
         conn.close()
     except Exception as e:
@@ -355,4 +889,14 @@ def process_video_generation(req: GenerateRequest):
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Brat Generator server")
+    parser.add_argument("--worker", action="store_true",
+                        help="Only run render workers against the shared job queue, no API")
+    args = parser.parse_args()
+
+    if args.worker:
+        asyncio.run(run_workers())
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,93 @@
+import os
+import random
+import shutil
+
+import pytest
+
+import main
+from main import (IncrementalLayout, _SizeEstimator, calculate_layout_metrics,
+                  calculate_word_positions, get_font, get_optimal_font_size,
+                  get_wrapped_lines, search_font_size)
+
+# The estimator only runs with a scalable font; PIL's fallback font skips it
+FONT_CANDIDATES = [
+    os.environ.get("LAYOUT_TEST_FONT", ""),
+    "arial.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+    "/Library/Fonts/Arial.ttf",
+    "C:\\Windows\\Fonts\\arial.ttf",
+]
+
+LYRICS = (
+    "I guess we're gonna have to go through it one more time tonight "
+    "everything is romantic when you're thinking about the city brat summer "
+    "forever 360 von dutch apple sympathy is a knife club classics so I so I "
+    "talk talk talk girl, so confusing supercalifragilisticexpialidocious "
+    "WHAT'S UP!!! ¿qué? naïve café déjà-vu ooh-ooh-ooh yeah yeah a I"
+).split()
+
+# (frame size, max_text_height, max_font)
+SIZES = [
+    ((1080, 1920), 960, 400),
+    ((1080, 1920), 400, 400),
+    ((720, 1280), 640, 250),
+    ((1920, 1080), 540, 120),
+]
+
+
+def corpus(seed=0, segments=40):
+    rng = random.Random(seed)
+    return [[rng.choice(LYRICS) for _ in range(rng.choice([1, 3, 8, 20, 45]))]
+            for _ in range(segments)]
+
+
+@pytest.fixture
+def truetype_font(tmp_path, monkeypatch):
+    """Runs the test with a real TrueType font as FONT_PATH."""
+    path = next((p for p in FONT_CANDIDATES if p and os.path.isfile(p)), None)
+    if path is None:
+        pytest.skip("no TrueType font found; set LAYOUT_TEST_FONT")
+    shutil.copy(path, tmp_path / main.FONT_PATH)
+    monkeypatch.chdir(tmp_path)
+    main._font_cache.clear()
+    yield
+    main._font_cache.clear()
+
+
+def reference_layout(words, size, max_text_height, max_font):
+    """Full binary search and wrapping of one prefix, as before the estimator."""
+    target_width = size[0] - 100
+
+    def check_fit(font_size):
+        font = get_font(font_size)
+        lines = get_wrapped_lines(words, font, target_width)
+        w, h, _, _ = calculate_layout_metrics(lines, font)
+        return w <= target_width and h <= max_text_height
+
+    font_size = search_font_size(check_fit, 20, max_font)
+    lines = get_wrapped_lines(words, get_font(font_size), target_width)
+    positions, _ = calculate_word_positions(lines, font_size, size)
+    return font_size, positions
+
+
+@pytest.mark.parametrize("size, max_text_height, max_font", SIZES)
+def test_estimated_sizes_match_full_search(truetype_font, size, max_text_height, max_font):
+    assert _SizeEstimator.create(size[0] - 100, max_text_height, 20, max_font) is not None
+
+    mismatches = []
+    for words in corpus():
+        layout = IncrementalLayout(size, max_text_height, max_font=max_font)
+        for n in range(1, len(words) + 1):
+            prefix = words[:n]
+            expected_size, expected_positions = reference_layout(
+                prefix, size, max_text_height, max_font)
+
+            optimal = get_optimal_font_size(prefix, (size[0], max_text_height), max_font=max_font)
+            font_size, positions, _ = layout.add_word(words[n - 1])
+
+            if (optimal, font_size, positions) != (expected_size, expected_size, expected_positions):
+                mismatches.append((" ".join(prefix), expected_size, optimal, font_size))
+
+    assert not mismatches
@@ -0,0 +1,45 @@
+import os
+import tracemalloc
+
+import numpy as np
+
+from main import iter_timeline_frames
+
+SIZE = (1080, 1920)
+FRAME_BYTES = SIZE[0] * SIZE[1] * 3
+# Peak memory allowed while streaming frames, whatever the timeline's length
+MEMORY_CEILING_MB = float(os.environ.get("FRAME_MEMORY_CEILING_MB", 32))
+
+
+def synthetic_timeline(words, duration=0.1):
+    # Lazy, like iter_timeline: entries are made only as they are pulled
+    for i in range(words):
+        yield {'start': i * duration, 'duration': duration, 'word': i}
+
+
+def render_frame(entry):
+    return np.full((SIZE[1], SIZE[0], 3), entry['word'] % 256, dtype=np.uint8)
+
+
+def peak_streaming_bytes(words):
+    background = np.zeros((SIZE[1], SIZE[0], 3), dtype=np.uint8)
+    tracemalloc.start()
+    try:
+        frames = 0
+        for frame in iter_timeline_frames(synthetic_timeline(words), words * 0.1, 24,
+                                          render_frame, background):
+            frames += 1
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert frames == words * 0.1 * 24
+    return peak
+
+
+def test_peak_memory_stays_under_ceiling_for_long_timelines():
+    short = peak_streaming_bytes(50)
+    long = peak_streaming_bytes(2000)
+
+    assert long <= MEMORY_CEILING_MB * 1024 * 1024
+    # Flat in the number of words: at most about one frame more
+    assert long - short < FRAME_BYTES
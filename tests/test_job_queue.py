@@ -0,0 +1,46 @@
+import job_queue
+
+
+def clip_outcome(clip_id, fingerprint):
+    return {"id": clip_id, "status": "render", "payload": "{}",
+            "base_name": clip_id, "fingerprint": fingerprint}
+
+
+def test_batch_clip_follows_identical_live_render(tmp_path):
+    db = str(tmp_path / "jobs.db")
+    job_queue.init_jobs(db)
+
+    job_queue.enqueue_job(db, "single", "{}", created_at=1)
+    assert job_queue.claim_job(db, "w1")["id"] == "single"
+    assert job_queue.lead_render(db, "single", "w1", "fp-a")
+
+    job_queue.enqueue_batch(db, "batch", "{}", [("clip0", "{}"), ("clip1", "{}")], created_at=2)
+    assert job_queue.claim_job(db, "w2")["id"] == "batch"
+    followers = job_queue.release_batch(
+        db, "batch", "w2", [clip_outcome("clip0", "fp-a"), clip_outcome("clip1", "fp-b")])
+    assert followers == ["clip0"]
+    assert job_queue.get_job(db, "clip0")["stage"] == job_queue.FOLLOW_STAGE
+
+    # Only clip1 is left to render
+    assert job_queue.claim_job(db, "w3", "render")["id"] == "clip1"
+    assert job_queue.claim_job(db, "w4", "render") is None
+
+    assert job_queue.finish_job(db, "single", "w1", "completed", "/generated/a.mp4")
+    clip0 = job_queue.get_job(db, "clip0")
+    assert (clip0["status"], clip0["result"]) == ("completed", "/generated/a.mp4")
+    assert job_queue.get_job(db, "batch")["status"] == "processing"
+
+    assert job_queue.finish_job(db, "clip1", "w3", "completed", "/generated/b.mp4")
+    assert job_queue.get_job(db, "batch")["status"] == "completed"
+
+
+def test_release_batch_of_cancelled_batch(tmp_path):
+    db = str(tmp_path / "jobs.db")
+    job_queue.init_jobs(db)
+
+    job_queue.enqueue_batch(db, "batch", "{}", [("clip0", "{}")])
+    assert job_queue.claim_job(db, "w1")["id"] == "batch"
+    job_queue.cancel_job(db, "batch")
+
+    assert job_queue.release_batch(db, "batch", "w1", [clip_outcome("clip0", "fp")]) is None
+    assert job_queue.get_job(db, "clip0")["status"] == "cancelled"
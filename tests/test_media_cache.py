@@ -0,0 +1,83 @@
+import multiprocessing
+import os
+import time
+
+import media_cache
+from media_cache import MediaCache
+
+SOURCE_ID = "video1"
+
+
+def fake_download(tmp_dir, seconds):
+    # One marker file per call, so the test can count downloads across
+    # processes
+    path = os.path.join(tmp_dir, f"download-{os.getpid()}.m4a")
+    with open(os.path.join(tmp_dir, f"called-{os.getpid()}"), "w"):
+        pass
+    time.sleep(seconds)
+    with open(path, "wb") as f:
+        f.write(b"audio bytes")
+    return path
+
+
+def fetch_in_process(root, tmp_dir, barrier, results):
+    media_cache.WAIT_POLL_SECONDS = 0.05
+    cache = MediaCache(root, 1 << 30)
+    barrier.wait()
+    results.put(cache.fetch(SOURCE_ID, lambda: fake_download(tmp_dir, 1.0)))
+
+
+def hang_in_download(root, tmp_dir):
+    MediaCache(root, 1 << 30).fetch(SOURCE_ID, lambda: fake_download(tmp_dir, 60))
+
+
+def downloads_started(tmp_dir):
+    return sum(name.startswith("called-") for name in os.listdir(tmp_dir))
+
+
+def test_concurrent_fetches_share_one_download(tmp_path):
+    root, tmp_dir = str(tmp_path / "media"), str(tmp_path)
+    ctx = multiprocessing.get_context("spawn")
+    callers = 4
+    barrier = ctx.Barrier(callers)
+    results = ctx.Queue()
+    processes = [ctx.Process(target=fetch_in_process, args=(root, tmp_dir, barrier, results))
+                 for _ in range(callers)]
+    for process in processes:
+        process.start()
+    paths = [results.get(timeout=60) for _ in processes]
+    for process in processes:
+        process.join(timeout=10)
+
+    assert downloads_started(tmp_dir) == 1
+    assert len(set(paths)) == 1 and os.path.exists(paths[0])
+    stats = MediaCache(root, 1 << 30).stats()
+    assert stats["downloads"] == 1
+    assert stats["shared"] == callers - 1
+
+
+def test_claim_of_killed_owner_is_taken_over(tmp_path, monkeypatch):
+    root, tmp_dir = str(tmp_path / "media"), str(tmp_path)
+    monkeypatch.setattr(media_cache, "CLAIM_STALE_SECONDS", 1)
+    monkeypatch.setattr(media_cache, "WAIT_POLL_SECONDS", 0.05)
+    cache = MediaCache(root, 1 << 30)
+
+    owner = multiprocessing.get_context("spawn").Process(
+        target=hang_in_download, args=(root, tmp_dir))
+    owner.start()
+    deadline = time.time() + 30
+    while downloads_started(tmp_dir) == 0:
+        assert time.time() < deadline
+        time.sleep(0.05)
+    # Dies holding the claim, without releasing it
+    owner.kill()
+    owner.join()
+
+    started = time.time()
+    path = cache.fetch(SOURCE_ID, lambda: fake_download(tmp_dir, 0))
+
+    assert path and os.path.exists(path)
+    # Waited for the claim to go stale rather than failing or hanging
+    assert 0.5 < time.time() - started < 10
+    assert downloads_started(tmp_dir) == 2
+    assert cache.stats()["downloads"] == 1
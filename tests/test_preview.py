@@ -0,0 +1,29 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from main import render_preview
+
+SLICES = [
+    [{"start": 0.0, "text": "I guess we're gonna have to go through it"},
+     {"start": 2.0, "text": "one more time tonight"}],
+    [{"start": 0.0, "text": "brat summer forever and ever"},
+     {"start": 2.0, "text": "so confusing"}],
+]
+
+
+def test_concurrent_previews_of_one_style_do_not_mix():
+    # Both slices use the default style, so every thread shares one
+    # FrameComposer
+    calls = [(i % len(SLICES), [i % 4, 4 + i % 2]) for i in range(64)]
+    expected = {(slice_idx, tuple(frames)): render_preview(SLICES[slice_idx], frames=frames)
+                for slice_idx, frames in calls}
+
+    def preview(call):
+        slice_idx, frames = call
+        return render_preview(SLICES[slice_idx], frames=frames)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(preview, calls))
+
+    wrong = [call for call, png in zip(calls, results)
+             if png != expected[(call[0], tuple(call[1]))]]
+    assert not wrong